@@ -5,9 +5,11 @@ import sys
 import cProfile
 import logging
 
-def main():
-    """ Run the game! """
+def main(options):
+    """ Run the game! Options override the corresponding Game attributes. """
     game = src.game.Game()
+    for (name, value) in options.items():
+        setattr(game, name, value)
     try:
         game.run()
     except KeyboardInterrupt:
@@ -19,11 +21,22 @@ if __name__ == '__main__':
     # Braindead arg parsing.
     do_profile=False
     do_logging=False
+    options = {}
     for arg in sys.argv[1:]:
         if arg == "--profile":
             do_profile = True
         elif arg == "--log":
             do_logging = True
+        elif arg.startswith("--seed="):
+            options["seed"] = int(arg[len("--seed="):])
+        elif arg.startswith("--checksums="):
+            options["checksum_file"] = arg[len("--checksums="):]
+        elif arg.startswith("--ticks="):
+            options["max_ticks"] = int(arg[len("--ticks="):])
+        elif arg.startswith("--record="):
+            options["record_file"] = arg[len("--record="):]
+        elif arg.startswith("--replay="):
+            options["replay_file"] = arg[len("--replay="):]
 
     # Set up logging.
     if do_logging:
@@ -31,6 +44,6 @@ if __name__ == '__main__':
 
     # Do profiling if we've asked for it.
     if do_profile:
-        cProfile.run("main()", "profile_results")
+        cProfile.run("main(options)", "profile_results")
     else:
-        main()
+        main(options)
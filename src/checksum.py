@@ -0,0 +1,40 @@
+""" Checksums of the game state.
+
+These are used to check that a change doesn't alter the behaviour of the
+game: run the old and new code with the same seed (see bin/compare_runs) and
+the checksums should match tick for tick. The checksum covers the state that
+matters most - the bodies, hitpoints, power and shields, and the number of
+entities. """
+
+import struct
+import zlib
+
+from .components import Body, Hitpoints, Power, Shields
+
+
+def state_checksum(entity_manager):
+    """ Get a checksum of the state of the game. Entities are not stored in a
+    reproducible order, so each entity's state is hashed separately and the
+    hashes are summed. """
+    total = 0
+    for entity in entity_manager.query_include_queued(Body):
+        body = entity.get_component(Body)
+        total += packed_crc("<4d",
+                            body.position[0],
+                            body.position[1],
+                            body.velocity[0],
+                            body.velocity[1])
+    for (tag, component_type, field) in ((1, Hitpoints, "hp"),
+                                         (2, Power, "power"),
+                                         (3, Shields, "hp")):
+        for entity in entity_manager.query_include_queued(component_type):
+            component = entity.get_component(component_type)
+            total += packed_crc("<Bd", tag, getattr(component, field))
+    return packed_crc("<QQ", total & 0xffffffffffffffff,
+                      entity_manager.entity_count())
+
+
+def packed_crc(fmt, *values):
+    """ Get the CRC of some packed values. Python 2's crc32 is signed, so
+    mask it to give the same answer everywhere. """
+    return zlib.crc32(struct.pack(fmt, *values)) & 0xffffffff
@@ -25,8 +25,11 @@ current state of the component, and these are updated by processing systems.
 
 
 from .ecs import Component, EntityRef, EntityRefList
+from .thrust import thruster_layout
 from .utils import Timer, Vec2d
 
+import numpy
+
 
 class Joint(Component):
     """ A joint between two bodies. """
@@ -38,6 +41,16 @@ class Joint(Component):
         self.entity_b_local_point = Vec2d(0, 0)
 
 
+class Attachment(Component):
+    """ The entity's Body is rigidly attached to a point on a parent's Body.
+    It is positioned from its parent each step rather than simulated, and is
+    only added to the space, as a kinematic shape, if it's collideable. """
+    def __init__(self, entity, game_services, config):
+        Component.__init__(self, entity, game_services, config)
+        self.parent = EntityRef(None, Body)
+        self.position = Vec2d(config.get_or_default("position", (0, 0)))
+
+
 class Body(Component):
     """ A physical body. """
     def __init__(self, entity, game_services, config):
@@ -61,6 +74,9 @@ class Tracking(Component):
         Component.__init__(self, entity, game_services, config)
         self.tracked = EntityRef(None, Body)
         self.track_type = config.get_or_default("track_type", "team")
+        self.range = config.get_or_none("range")
+        self.retry_timer = Timer(config.get_or_default("retry_period", 0.25))
+        self.retry_timer.advance_to_fraction(1)
 
 
 class FollowsTracked(Component):
@@ -90,6 +106,18 @@ class LaunchesFighters(Component):
         self.launched = EntityRefList()
 
 
+class Squadron(Component):
+    """ Stands in for a group of launched fighters while they're far from
+    anything. The entity's Hitpoints are the fighters' hitpoints summed, and
+    each member is remembered as its offset from the squadron's Body and its
+    hitpoints, so that the fighters can be put back. """
+    def __init__(self, entity, game_services, config):
+        Component.__init__(self, entity, game_services, config)
+        self.fighter_config = None
+        self.members = []
+        self.launcher = EntityRef(None, LaunchesFighters)
+
+
 class KillOnTimer(Component):
     """ For objects that should be destroyed after a limited time. """
     def __init__(self, entity, game_services, config):
@@ -97,6 +125,18 @@ class KillOnTimer(Component):
         self.lifetime = Timer(config["lifetime"])
 
 
+class Projectile(Component):
+    """ The entity's Body flies in a straight line without being simulated,
+    and hits what it passes through. """
+    pass
+
+
+class Effect(Component):
+    """ The entity's Body is just a position and velocity for something that
+    never collides, like an explosion. It isn't simulated. """
+    pass
+
+
 class ExplodesOnDeath(Component):
     """ For objects that spawn an explosion when they die. """
     pass
@@ -145,6 +185,20 @@ class Team(Component):
         self.parent = EntityRef(None, Team)
 
 
+def get_team(e):
+    """ Get the team of an entity.  If the entity does not have a team then
+    this returns None. """
+    assert e is not None
+    ret = None
+    ct = e.get_component(Team)
+    if ct is not None:
+        if ct.parent.entity is not None:
+            ret = get_team(ct.parent.entity)
+        if ret is None:
+            ret = ct.team
+    return ret
+
+
 class Text(Component):
     """ The entity contains text. """
     def __init__(self, entity, game_services, config):
@@ -208,25 +262,21 @@ class AnimationComponent(Component):
         return ret
 
 
-class Thruster(Component):
-    """ The logical definition of a thruster on a Body. """
-    def __init__(self, entity, game_services, config):
-        Component.__init__(self, entity, game_services, config)
-        self.position = Vec2d(config.get_or_default("position", (0, 0)))
-        self.direction = Vec2d(config.get_or_default("orientation", (0, 1)))
-        self.max_thrust = config.get_or_default("max_thrust", 0)
-        self.thrust = 0
-        self.attached_to = EntityRef(None, Thrusters)
-
-
 class Thrusters(Component):
-    """ The entity has thrusters & a target direction. """
+    """ The entity has thrusters & a target direction. The thrusters are
+    defined in the config, and are held as arrays with a row per thruster:
+    positions and directions relative to the body, and the maximum and
+    current thrusts. """
     def __init__(self, entity, game_services, config):
         Component.__init__(self, entity, game_services, config)
         self.direction = Vec2d(0, 0)
         self.turn = 0
-        self.thrusters = EntityRefList(Thruster)
-        self.thruster_configurations = {}
+        self.layout = thruster_layout(config.get_or_default("thrusters", []))
+        table = numpy.array(self.layout, dtype=float).reshape(-1, 5)
+        self.positions = table[:, 0:2]
+        self.directions = table[:, 2:4]
+        self.max_thrusts = table[:, 4]
+        self.thrusts = numpy.zeros(len(self.layout))
 
 
 class Turret(Component):
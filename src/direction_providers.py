@@ -6,6 +6,8 @@ from .physics import Vec2d
 from .ecs import EntityRef
 from .components import Body
 
+import numpy
+
 
 class DirectionProvider(object):
     """ An object that defines a direction. """
@@ -67,6 +69,84 @@ class DirectionProviderBody(object):
         return -(-to_body.position + from_body.position).normalized()
 
 
+class DirectionProviderLead(object):
+    """ Shooting at a body, leading it so that bullets of a given speed,
+    fired with the shooter's velocity, meet it. The TurretSystem solves for
+    all of the turrets at once each tick; until then, the direction is solved
+    for on its own. """
+    def __init__(self, from_body_entity, to_body_entity, bullet_speed):
+        self.__from_body_entity = EntityRef(from_body_entity, Body)
+        self.__to_body_entity = EntityRef(to_body_entity, Body)
+        self.__bullet_speed = bullet_speed
+        self.solved = None
+    def state(self):
+        """ Get the (shooter position, shooter velocity, target position,
+        target velocity, bullet speed) to solve for, or None if either body
+        has gone. """
+        if self.__from_body_entity.entity is None:
+            return None
+        if self.__to_body_entity.entity is None:
+            return None
+        from_body = self.__from_body_entity.entity.get_component(Body)
+        to_body = self.__to_body_entity.entity.get_component(Body)
+        return (tuple(from_body.position), tuple(from_body.velocity),
+                tuple(to_body.position), tuple(to_body.velocity),
+                self.__bullet_speed)
+    def direction(self):
+        if self.solved is None:
+            solve_leads([self])
+        return self.solved
+
+
+def solve_leads(providers):
+    """ Solve the directions of some DirectionProviderLeads together. """
+    states = [provider.state() for provider in providers]
+    rows = [state for state in states if state is not None]
+    directions = iter(solve_intercepts(
+        *(numpy.array(column, dtype=float) for column in zip(*rows))
+    ) if len(rows) > 0 else [])
+    for (provider, state) in zip(providers, states):
+        if state is None:
+            provider.solved = Vec2d(0, 0)
+        else:
+            provider.solved = Vec2d(next(directions).tolist())
+
+
+def solve_intercepts(shooter_positions, shooter_velocities,
+                     target_positions, target_velocities, speeds):
+    """ Get the directions to fire bullets of the given speeds in, so that
+    they meet their targets. Each argument has a row per shot.
+
+    With the target at r relative to the shooter and moving at v relative to
+    it (bullets inherit the shooter's velocity), a bullet of speed s meets it
+    at the first time t > 0 where |r + vt| = st, i.e. where
+
+        (v.v - s^2) t^2 + 2 (r.v) t + r.r = 0
+
+    and should be fired towards r + vt. If the bullet can never catch the
+    target, we fire straight at it. """
+    r = target_positions - shooter_positions
+    v = target_velocities - shooter_velocities
+    a = (v * v).sum(axis=1) - speeds ** 2
+    b = 2 * (r * v).sum(axis=1)
+    c = (r * r).sum(axis=1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        root = numpy.sqrt(b * b - 4 * a * c)
+        roots = numpy.array([(-b - root) / (2 * a),
+                             (-b + root) / (2 * a),
+                             -c / b])
+    quadratic = numpy.abs(a) > 1e-9
+    roots[0:2, ~quadratic] = numpy.nan
+    roots[2, quadratic] = numpy.nan
+    roots[numpy.isnan(roots)] = numpy.inf
+    roots[roots <= 0] = numpy.inf
+    times = roots.min(axis=0)
+    times[~numpy.isfinite(times)] = 0
+    aims = r + v * times[:, numpy.newaxis]
+    lengths = numpy.sqrt((aims * aims).sum(axis=1))
+    return aims / numpy.where(lengths > 0, lengths, 1)[:, numpy.newaxis]
+
+
 class DirectionProviderCoaxial(object):
     """ Shooting in line with a body. """
     def __init__(self, from_body_entity):
@@ -1,15 +1,17 @@
 """ Draw the game using a Renderer. """
 
 from pygame import Rect
-import random
 
 from .physics import Physics
-from .components import Body, Thrusters, Thruster, Hitpoints, Text, Shields, \
+from .systems import BudgetSystem, ParticleSystem
+from .components import Body, Thrusters, Hitpoints, Text, Shields, \
                         AnimationComponent, Weapon, Power, Camera
 from .renderer import Renderer, View
 from .ecs import EntityRef
 from .utils import Vec2d, Polygon
 
+import numpy
+
 class CameraView(View):
     """ A view defined by a camera entity. """
 
@@ -59,6 +61,10 @@ class Drawing(object):
         self.__font = None
         self.__game_services = game_services
 
+        # Our own random number stream, so drawing doesn't disturb the
+        # streams the simulation uses.
+        self.__random = self.__entity_manager.random_stream("Drawing")
+
     def set_background(self, image_name):
         """ Load a background image. """
         self.__background_image = self.__resource_loader.load_image(image_name)
@@ -71,6 +77,7 @@ class Drawing(object):
 
         # Draw the things we can draw.
         self.__draw_animations(camera)
+        self.__draw_particles(camera)
         self.__draw_thrusters(camera)
         self.__draw_shields(camera)
         self.__draw_lasers(camera)
@@ -129,7 +136,7 @@ class Drawing(object):
             # If something is being hit, draw an impact effect.
             dir = weapon.impact_normal
             if dir is not None:
-                impact_size = radius * 15 * (1.0 + random.random()*0.6-0.8)
+                impact_size = radius * 15 * (1.0 + self.__random.random()*0.6-0.8)
                 poly1 = Polygon.make_bullet_polygon(p1, p1 + (dir * impact_size))
                 self.__renderer.add_job_polygon(poly1, colour=white, brightness=5)
                 poly2 = Polygon.make_bullet_polygon(p1, p1 + (dir * impact_size * 0.8))
@@ -169,25 +176,39 @@ class Drawing(object):
                 **kwargs
             )
 
+    def __draw_particles(self, camera):
+        """ Draw the particles, a batch per emitter. """
+        particles = self.__entity_manager.get_system(ParticleSystem)
+        if particles is None:
+            return
+        for emitter in particles.emitters():
+            if emitter.count > 0:
+                self.__renderer.add_job_particles(
+                    emitter.frames,
+                    emitter.positions[:emitter.count],
+                    emitter.frame_indices(),
+                    brightness=emitter.brightness
+                )
+
     def __draw_thrusters(self, camera):
         """ Draw the thrusters affecting the body. """
         physics = self.__entity_manager.get_system(Physics)
         entities = self.__entity_manager.query(Body, Thrusters)
         for entity in entities:
             thrusters = entity.get_component(Thrusters)
-            for thruster_ent in thrusters.thrusters:
-                thruster = thruster_ent.get_component(Thruster)
-                if thruster.thrust > 0:
-                    pos = physics.local_to_world(entity, thruster.position)
-                    dir = physics.local_dir_to_world(entity, thruster.direction)
-                    length = thruster.thrust / 500.0
-                    length *= (1.0 + random.random()*0.1 - 0.2)
-                    poly = Polygon.make_bullet_polygon(pos, pos-(dir*length))
-                    self.__renderer.add_job_polygon(
-                        poly,
-                        colour=(255, 255, 255),
-                        brightness=2
-                    )
+            for i in numpy.flatnonzero(thrusters.thrusts > 0):
+                position = Vec2d(thrusters.positions[i].tolist())
+                direction = Vec2d(thrusters.directions[i].tolist())
+                pos = physics.local_to_world(entity, position)
+                dir = physics.local_dir_to_world(entity, direction)
+                length = float(thrusters.thrusts[i]) / 500.0
+                length *= (1.0 + self.__random.random()*0.1 - 0.2)
+                poly = Polygon.make_bullet_polygon(pos, pos-(dir*length))
+                self.__renderer.add_job_polygon(
+                    poly,
+                    colour=(255, 255, 255),
+                    brightness=2
+                )
 
     def __draw_hitpoints(self, camera):
         """ Draw the entity's hitpoints, or a marker showing where it
@@ -364,6 +385,44 @@ class Drawing(object):
             (10, 90)
         )
 
+        # Draw the body pool statistics.
+        physics = self.__entity_manager.get_system(Physics)
+        if physics is not None:
+            pool_stats = physics.pool_stats()
+            self.__renderer.add_job_text(
+                self.__font,
+                "Body pool: %s free, %s/%s recycled" % (
+                    pool_stats["free"],
+                    pool_stats["hits"],
+                    pool_stats["hits"] + pool_stats["misses"]
+                ),
+                (10, 110)
+            )
+            (awake, asleep) = physics.sleep_stats()
+            self.__renderer.add_job_text(
+                self.__font,
+                "Bodies: %s awake, %s asleep" % (awake, asleep),
+                (10, 130)
+            )
+
+        # Draw what has been done to keep within budgets.
+        budgets = self.__entity_manager.get_system(BudgetSystem)
+        if budgets is not None:
+            budget_stats = budgets.stats()
+            self.__renderer.add_job_text(
+                self.__font,
+                "Budgets: %s" % ", ".join(
+                    "%s %s live, %s recycled, %s merged, %s dropped" % (
+                        category,
+                        stats["live"],
+                        stats["recycled"],
+                        stats["merged"],
+                        stats["dropped"]
+                    ) for (category, stats) in budget_stats.items()
+                ),
+                (10, 150)
+            )
+
     def __draw_bar(self, camera, arg_rect, fraction,
                    col_back, col_0, col_1):
         """ Draw a progress bar """
@@ -35,13 +35,18 @@ then the Team defaults to 'player'.
 Entity processing 'systems' can be registered with the entity manager. A system
 operates on a subset of the entities in the manager, determined by a query.
 Systems can be update()ed, allowing them to make changes to the entities they
-operate on.
+operate on. A system can ask for its entities to be updated less often than
+every frame, and less often still the further they are from the level of
+detail origins, e.g. the cameras - see ComponentSystem.due_entities().
 
 Global services are exposed via a 'game services' object.  This is injected
 into each component.
 """
 
+import numpy
 import pickle
+import random
+import zlib
 
 from .config import Config
 from .utils import lookup_type, bail
@@ -126,6 +131,12 @@ class EntityManager(object):
         self.__entities = []
         self.__new_entities = []
 
+        # Entities that have been built ahead of time, but which don't join
+        # the game until they're activated. While we're creating dormant
+        # entities, any entities they create are dormant too.
+        self.__dormant_entities = []
+        self.__creating_dormant = 0
+
         # Map from component concrete type to component store.
         self.__component_store = ComponentStore()
 
@@ -138,6 +149,82 @@ class EntityManager(object):
         # Is the simulation paused?
         self.__paused = False
 
+        # Named random number streams, all derived from one seed so that a
+        # game can be replayed exactly. Each system gets its own stream, so
+        # one system using more or fewer numbers doesn't disturb the others.
+        self.__seed = 0
+        self.__random_streams = {}
+
+        # The serial number for the next entity.
+        self.__next_serial = 0
+
+        # Simulation level of detail is measured from these points, e.g. the
+        # cameras, using a function that gives an entity's position. Each
+        # entity's distance is worked out once per frame, on first use, and
+        # shared by all of the systems.
+        self.__lod_origins = []
+        self.__lod_position = None
+        self.__lod_distances = {}
+
+    def set_seed(self, seed):
+        """ Reseed all of the random number streams. """
+        self.__seed = seed
+        for (name, stream) in self.__random_streams.items():
+            stream.seed(self.__stream_seed(name))
+
+    def get_seed(self):
+        """ Get the seed the random number streams derive from. """
+        return self.__seed
+
+    def random_stream(self, name):
+        """ Get the random number stream with the given name. """
+        if not name in self.__random_streams:
+            self.__random_streams[name] = random.Random(self.__stream_seed(name))
+        return self.__random_streams[name]
+
+    def __stream_seed(self, name):
+        """ Derive the seed for a named stream. This needs to be the same on
+        every platform and python version, so no hash(). """
+        return zlib.crc32(("%s:%s" % (self.__seed, name)).encode("utf-8")) \
+            & 0xffffffff
+
+    def set_lod_origins(self, origins, position_of):
+        """ Set the points that level of detail is measured from, and a
+        function that gives the position of an entity, or None if it hasn't
+        got one. Distances already worked out this frame are kept, so the
+        new origins are used from the next frame. """
+        self.__lod_origins = list(origins)
+        self.__lod_position = position_of
+
+    def lod_distances(self, entities):
+        """ Get the distance of each entity from the nearest level of detail
+        origin. Entities without a position are at distance 0, as are all
+        entities if there are no origins. """
+        if len(self.__lod_origins) == 0:
+            return numpy.zeros(len(entities))
+        cache = self.__lod_distances
+        missing = []
+        positions = []
+        for entity in entities:
+            if not entity in cache:
+                position = self.__lod_position(entity)
+                if position is None:
+                    cache[entity] = 0
+                else:
+                    missing.append(entity)
+                    positions.append(tuple(position))
+        if len(positions) > 0:
+            offsets = numpy.array(positions, dtype=float)[:, numpy.newaxis, :] - \
+                numpy.array(self.__lod_origins, dtype=float)[numpy.newaxis, :, :]
+            distances = numpy.sqrt((offsets ** 2).sum(axis=2).min(axis=1))
+            cache.update(zip(missing, distances))
+        return numpy.array([cache[e] for e in entities], dtype=float)
+
+    def entity_count(self):
+        """ Get the number of entities, including queued and dormant ones. """
+        return len(self.__entities) + len(self.__new_entities) + \
+            len(self.__dormant_entities)
+
     def pause(self):
         """ Pause the simulation. """
         self.__paused = True
@@ -157,13 +244,31 @@ class EntityManager(object):
         self.__entities += self.__new_entities
         del self.__new_entities[:]
 
+    def activate_dormant_entities(self):
+        """ Queue all of the dormant entities for creation, as if they had
+        just been created. Returns the activated entities. """
+        activated = [e for e in self.__dormant_entities if not e.is_garbage]
+        for e in activated:
+            e.set_dormant(False)
+        self.__new_entities += activated
+        del self.__dormant_entities[:]
+        return activated
+
+    def kill_dormant_entities(self):
+        """ Kill all of the dormant entities, when what they were built for
+        has been abandoned. They go at the next garbage collection. """
+        for e in self.__dormant_entities:
+            e.kill()
+
     def save(self, output_file):
         """ Save the state of the entity manager. """
         self.__garbage_collect()
         output = {
             "entities" : self.__entities,
             "new_entities" : self.__new_entities,
-            "components" : self.__component_store
+            "dormant_entities" : self.__dormant_entities,
+            "components" : self.__component_store,
+            "next_serial" : self.__next_serial
         }
         pickle.dump(output, output_file)
 
@@ -173,21 +278,39 @@ class EntityManager(object):
             old_state = pickle.load(input_file)
             entities = old_state["entities"]
             new_entities = old_state["new_entities"]
-            for e in (entities + new_entities):
+            dormant_entities = old_state.get("dormant_entities", [])
+            for e in (entities + new_entities + dormant_entities):
                 e.just_unpickled(self.__game_services)
             components = old_state["components"]
+
+            # Older saves didn't record the next serial number, so carry on
+            # from the highest one in use.
+            next_serial = old_state.get("next_serial")
+            if next_serial is None:
+                serials = [e.serial for e in
+                           (entities + new_entities + dormant_entities)
+                           if e.serial is not None]
+                next_serial = max(serials + [-1]) + 1
             self.__entities = entities
             self.__new_entities = new_entities
+            self.__dormant_entities = dormant_entities
             self.__component_store = components
+            self.__next_serial = next_serial
         except:
             bail()
 
+        # Let the systems rebuild any state derived from the components.
+        for system in self.__systems:
+            system.on_load()
+
     def __garbage_collect(self):
         """ Remove all of the objects that have been marked for deletion."""
         self.__component_store.garbage_collect(self.__systems)
         for o in self.__entities:
             if o.is_garbage:
                 self.__entities.remove(o)
+        self.__dormant_entities = [o for o in self.__dormant_entities
+                                   if not o.is_garbage]
 
     def create_entity_with(self, *types):
         """ Create a new entity with a given list of components. """
@@ -215,7 +338,10 @@ class EntityManager(object):
 
         # Instantiate the object.
         t = lookup_type(config.get_or_default("type", "src.ecs.Entity"))
-        obj = t(self.__game_services)
+        obj = t(self.__game_services, self.__next_serial)
+        self.__next_serial += 1
+        if self.__creating_dormant > 0:
+            obj.set_dormant(True)
 
         # Add components specified in the config.
         components = config.get_or_default("components", Config())
@@ -226,13 +352,28 @@ class EntityManager(object):
             obj.add_component(component)
 
         # Add the object to the creation queue, and return it to the caller.
-        self.__new_entities.append(obj)
+        if obj.is_dormant:
+            self.__dormant_entities.append(obj)
+        else:
+            self.__new_entities.append(obj)
 
         return obj
 
+    def create_dormant_entity(self, config_name=None):
+        """ Create an entity that doesn't join the game until
+        activate_dormant_entities() is called, along with any entities that
+        its components create. This lets expensive entities be built ahead
+        of time. """
+        self.__creating_dormant += 1
+        try:
+            return self.create_entity(config_name)
+        finally:
+            self.__creating_dormant -= 1
+
     def register_component_system(self, system):
         """ Register a component system. """
         self.__systems.append(system)
+        system.random = self.random_stream(system.__class__.__name__)
         system.setup(self.__game_services)
         self.__systems = sorted(
             self.__systems,
@@ -267,12 +408,14 @@ class EntityManager(object):
         matches = self.__component_store.query_entities(type1, *types)
 
         # Don't expose entities that don't technically exist yet.
-        return filter(lambda x: x not in self.__new_entities, matches)
+        return filter(lambda x: not x.is_dormant and \
+                      x not in self.__new_entities, matches)
 
     def query_include_queued(self, type1, *types):
         """ Get all entities with a particular set of components. 
         
-        This includes entities that are queued for creation. """
+        This includes entities that are queued for creation, and dormant
+        entities. """
 
         return self.__component_store.query_entities(type1, *types)
 
@@ -284,6 +427,7 @@ class EntityManager(object):
 
     def update(self, dt):
         """ Update all of the systems in priority order. """
+        self.__lod_distances = {}
         for system in self.__systems:
             if not self.__paused or system.updates_when_paused:
                 system.update(dt)
@@ -371,11 +515,22 @@ class ComponentSystem(object):
     """ Entity processing system.  Can do updates on a set of entities with
     a given set of components. """
 
-    def __init__(self, types, priority=0):
-        """ Initialise. """
+    def __init__(self, types, priority=0, update_period=0, lod_bands=()):
+        """ Initialise. Each entity is updated every 'update_period' seconds,
+        where 0 means every frame, or with the period of the furthest of the
+        'lod_bands' - a list of (distance, period) - that it's beyond. """
         self.__types = types
         self.__priority = priority
         self.__game_services = None
+        self.__update_period = update_period
+        self.__lod_bands = sorted(lod_bands)
+
+        # The time since each entity was updated, and until it is due.
+        self.__schedule = {}
+
+        # The system's random number stream. This is replaced by a seeded
+        # stream when the system is registered.
+        self.random = random.Random(0)
 
     def setup(self, game_services):
         """ Do any initial setup. """
@@ -389,6 +544,41 @@ class ComponentSystem(object):
         """ Get the entities managed by this system. """
         return self.__game_services.get_entity_manager().query(*self.__types)
 
+    def due_entities(self, dt):
+        """ Get the entities that are due an update this frame, each with the
+        time since it was last updated, to use as its dt. An entity is due
+        on the frame it first appears; after that, entities with the same
+        period are staggered across frames by serial number, so that their
+        updates don't all fall on the same frame. """
+        entities = self.entities()
+        if self.__update_period == 0 and len(self.__lod_bands) == 0:
+            return [(e, dt) for e in entities]
+        distances = None
+        if len(self.__lod_bands) > 0:
+            ecs = self.__game_services.get_entity_manager()
+            distances = ecs.lod_distances(entities)
+        due = []
+        schedule = {}
+        for (i, entity) in enumerate(entities):
+            period = self.__update_period
+            if distances is not None:
+                for (distance, band_period) in self.__lod_bands:
+                    if distances[i] >= distance:
+                        period = band_period
+            if entity in self.__schedule:
+                (elapsed, wait) = self.__schedule[entity]
+                elapsed += dt
+                wait -= dt
+                if wait <= 0:
+                    due.append((entity, elapsed))
+                    (elapsed, wait) = (0, max(wait + period, 0))
+            else:
+                due.append((entity, dt))
+                (elapsed, wait) = (0, period * ((hash(entity) * 0.618034) % 1))
+            schedule[entity] = (elapsed, wait)
+        self.__schedule = schedule
+        return due
+
     def update(self, dt):
         """ Update the system. """
         pass
@@ -405,6 +595,10 @@ class ComponentSystem(object):
         """ Called when a component is removed that matches our expression. """
         pass
 
+    def on_load(self):
+        """ Called when the entity manager's state has been restored. """
+        pass
+
     @property
     def priority(self):
         """ Priority - determines order of system update() calls. """
@@ -527,18 +721,46 @@ class Entity(object):
     will then be True. At the end of the current frame, on_object_killed() will
     be called for that entity, and the entity will be removed from the entity
     manager.
+
+    An entity can also be dormant: it has its components, but it takes no
+    part in the game until the entity manager activates it.
     """
 
-    def __init__(self, game_services):
-        """ Constructor. """
+    def __init__(self, game_services, serial=None):
+        """ Constructor. The entity manager gives each entity a serial number,
+        which is used as its hash so that dicts and sets of entities are
+        iterated in the same order every time the game is run. """
         self.__is_garbage = False
+        self.__is_dormant = False
         self.__game_services = game_services
+        self.__serial = serial
+
+    def __hash__(self):
+        """ Hash by serial number, if we have one. """
+        if self.__serial is None:
+            return object.__hash__(self)
+        return self.__serial
+
+    @property
+    def serial(self):
+        """ Get the serial number, or None if we don't have one. """
+        return self.__serial
 
     @property
     def is_garbage(self):
         """ Is this entity scheduled for deletion? """
         return self.__is_garbage
 
+    @property
+    def is_dormant(self):
+        """ Is this entity waiting to be activated? """
+        return self.__is_dormant
+
+    def set_dormant(self, dormant):
+        """ Set whether the entity is dormant. Only the entity manager should
+        call this. """
+        self.__is_dormant = dormant
+
     @property
     def game_services(self):
         """ Get the game services. """
@@ -576,3 +798,10 @@ class Entity(object):
         assert field_name in ret
         ret[field_name] = None
         return ret
+
+    def __setstate__(self, state):
+        """ Restore the state, allowing for entities saved before they had
+        serial numbers or could be dormant. """
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_Entity__serial", None)
+        self.__dict__.setdefault("_Entity__is_dormant", False)
@@ -5,9 +5,11 @@ A space game written in Python.
 # Standard imports.
 import pygame
 import os
+import random
 import sys
 
 # Local imports.
+import checksum
 import components
 import drawing
 import ecs
@@ -119,6 +121,9 @@ class Game(object):
         self.resource_loader.set_minimise_image_loading(
             self.config.get_or_default("minimise_image_loading", False)
         )
+        self.resource_loader.set_thrust_solutions_file(
+            self.config.get_or_none("thrust_solutions_file")
+        )
 
         # The drawing visitor.
         self.drawing = drawing.Drawing(self.game_services)
@@ -138,6 +143,24 @@ class Game(object):
         # Should we simulate one frame and then pause?
         self.want_step = False
 
+        # The seed for the random number streams. Running again with the same
+        # seed (and the same input) should give the same game.
+        self.seed = self.config.get_or_none("seed")
+        if self.seed is None:
+            self.seed = random.randrange(1 << 31)
+
+        # If set, a checksum of the game state is written to this file each
+        # tick, so that runs can be compared.
+        self.checksum_file = self.config.get_or_none("checksum_file")
+
+        # If set, stop after this many ticks.
+        self.max_ticks = self.config.get_or_none("max_ticks")
+
+        # If set, the player's actions are recorded to this file, or replayed
+        # from it instead of taking input.
+        self.record_file = self.config.get_or_none("record_file")
+        self.replay_file = self.config.get_or_none("replay_file")
+
     def stop_running(self):
         """ Stop the game from running. """
         self.running = False
@@ -153,17 +176,39 @@ class Game(object):
         pygame.mixer.init()
         self.renderer.initialise()
 
+        # A replay has to use the seed it was recorded with.
+        replay = None
+        if self.replay_file is not None:
+            replay = input_handling.ActionReplay(self.replay_file)
+            self.seed = replay.seed
+
+        # Seed the random number streams. Anything still using the global
+        # stream gets seeded too.
+        random.seed(self.seed)
+        self.entity_manager.set_seed(self.seed)
+
         # Create the game systems.
-        self.entity_manager.register_component_system(physics.Physics())
+        self.entity_manager.register_component_system(physics.Physics(
+            self.config.get_or_none("physics")
+        ))
+        self.entity_manager.register_component_system(systems.BudgetSystem(
+            self.config.get_or_none("budgets")
+        ))
+        self.entity_manager.register_component_system(systems.ProjectileSystem())
+        self.entity_manager.register_component_system(systems.DamageSystem())
+        self.entity_manager.register_component_system(systems.EffectSystem())
         self.entity_manager.register_component_system(systems.FollowsTrackedSystem())
         self.entity_manager.register_component_system(systems.TrackingSystem())
         self.entity_manager.register_component_system(systems.LaunchesFightersSystem())
+        self.entity_manager.register_component_system(systems.SquadronSystem(
+            self.config.get_or_none("squadrons")
+        ))
         self.entity_manager.register_component_system(systems.KillOnTimerSystem())
         self.entity_manager.register_component_system(systems.PowerSystem())
         self.entity_manager.register_component_system(systems.ShieldSystem())
         self.entity_manager.register_component_system(systems.TextSystem())
         self.entity_manager.register_component_system(systems.AnimSystem())
-        self.entity_manager.register_component_system(systems.ThrusterSystem())
+        self.entity_manager.register_component_system(systems.ParticleSystem())
         self.entity_manager.register_component_system(systems.ThrustersSystem())
         self.entity_manager.register_component_system(systems.WaveSpawnerSystem())
         self.entity_manager.register_component_system(systems.CameraSystem())
@@ -177,6 +222,7 @@ class Game(object):
         # Make the camera.
         camera = self.entity_manager.create_entity_with(components.Camera,
                                                              components.Body,
+                                                             components.Effect,
                                                              components.Tracking,
                                                              components.FollowsTracked)
         camera.get_component(components.FollowsTracked).follow_type = "instant"
@@ -194,6 +240,10 @@ class Game(object):
 
         # Make the input handling system.
         self.input_handling = input_handling.InputHandling(view, self.game_services)
+        recorder = None
+        if self.record_file is not None:
+            recorder = input_handling.ActionRecorder(self.record_file, self.seed)
+            self.input_handling.set_recorder(recorder)
 
         # Create the wave spawner.
         if not self.config.get_or_default("peaceful_mode", False):
@@ -201,17 +251,25 @@ class Game(object):
 
         # Make it so that bullets can damage things.
         self.entity_manager.get_system(physics.Physics).add_collision_handler(
-            DamageCollisionHandler()
+            DamageCollisionHandler(
+                self.entity_manager.get_system(systems.DamageSystem)
+            )
         )
 
         # Set the scrolling background.
         self.drawing.set_background("res/images/857-tileable-classic-nebula-space-patterns/6.jpg")
 
+        # Open the checksum file, if we're writing one.
+        checksum_output = None
+        if self.checksum_file is not None:
+            checksum_output = open(self.checksum_file, "w")
+
         # Run the game loop.
         self.running = True
         fps = 60
         clock = pygame.time.Clock()
         tick_time = 1.0/fps
+        tick = 0
         while self.running:
 
             # Has a load been requested?
@@ -239,14 +297,33 @@ class Game(object):
                 self.want_pause = True
                 self.want_step = False
 
-            # Input
+            # Input. When replaying, only a request to close the window is
+            # taken from the user.
+            if recorder is not None:
+                recorder.tick = tick
             for e in pygame.event.get():
+                if replay is not None and e.type != pygame.QUIT:
+                    continue
                 response = self.input_handling.handle_input(e)
                 if response.quit_requested:
                     self.running = False
+            if replay is not None:
+                response = self.input_handling.replay(replay.actions_at(tick))
+                if response.quit_requested:
+                    self.running = False
 
             # Update the systems.
             self.entity_manager.update(tick_time)
+            tick += 1
+
+            # Record the state, and stop if we've run for long enough.
+            if checksum_output is not None:
+                checksum_output.write("%s %08x\n" % (
+                    tick,
+                    checksum.state_checksum(self.entity_manager)
+                ))
+            if self.max_ticks is not None and tick >= self.max_ticks:
+                self.running = False
 
             # Draw
             self.renderer.pre_render(view)
@@ -266,6 +343,11 @@ class Game(object):
                                                      time_ratio)
 
         # Finalise
+        if checksum_output is not None:
+            checksum_output.close()
+        if recorder is not None:
+            recorder.close()
+        self.resource_loader.save_thrust_solutions()
         pygame.quit()
 
     def load(self):
@@ -291,7 +373,7 @@ class Game(object):
 class DamageCollisionHandler(physics.CollisionHandler):
     """ Collision handler to apply bullet damage. """
 
-    def __init__(self):
+    def __init__(self, damage_system):
         """ Constructor. """
 
         # Match entities that cause damage on contact to entities that can be
@@ -301,12 +383,14 @@ class DamageCollisionHandler(physics.CollisionHandler):
             components.DamageOnContact,
             components.Hitpoints
         )
+        self.__damage_system = damage_system
 
     def handle_matching_collision(self, dmg, hp):
-        """ Apply the logical effect of the collision and return the result. """
+        """ Queue the damage, to be applied after the physics step, and
+        return the result. """
 
-        # Delegate to the function in 'systems'.
-        systems.handle_damage_collision(dmg, hp)
+        # The damage system does the rest.
+        self.__damage_system.queue_damage(dmg, hp)
 
         # Return the result ( we handled the collision. )
         return physics.CollisionResult(True, True)
@@ -8,12 +8,18 @@ While the keybindings are presently hard coded, the way mappings are represented
 could easily be saved out and read back in, allowing for full customisation.
 
 The scheme allows for keyboard, mouse and joystick input.
+
+The actions performed on each tick can be recorded along with the random seed
+by an ActionRecorder, and fed back in by an ActionReplay, to play the same game
+again. Actions are recorded rather than input events so that the replay doesn't
+depend on the key bindings.
 """
 
 from pymunk.vec2d import Vec2d
 
 import pygame
 import collections
+import json
 
 from .components import Thrusters, Player, Camera, Turrets, Turret
 from .direction_providers import DirectionProviderScreen
@@ -48,6 +54,9 @@ class Action(object):
         assert description is not None
         self.description = description
 
+        # The name of the action in its Actions table.
+        self.name = None
+
     def execute(self, alternate):
         """ Execute the action. If 'alternate' is true then an 'alternate'
         action should be performed - for instance if this action is handling
@@ -185,35 +194,45 @@ class Actions(object):
                                     lambda: handler.print_keybindings())
         self.SHOOT = ShootAction("Shoot", handler)
 
+        # Let each action know its name, for recording.
+        for (name, action) in vars(self).items():
+            action.name = name
+
 
 class KeyMap(object):
     """ A mapping from keys to actions. """
 
-    def __init__(self, name, mapping):
+    def __init__(self, name, mapping, on_execute=None):
         """ Constructor. 'mapping' should be a dict-like mapping from keys
-        to actions to be executed. """
+        to actions to be executed. If given, 'on_execute' is called with the
+        action, the name of the execute method and its arguments before each
+        action is executed. """
         self.__name = name
         self.__mapping = mapping
+        self.__on_execute = on_execute
 
     def execute(self, key, alternate):
         """ If this key is mapped to an action, execute the corresponding action
         and return the response. """
-        if key in self.__mapping:
-            return self.__mapping[key].execute(alternate)
-        return InputResponse()
+        return self.__execute(key, "execute", alternate)
 
     def execute_position(self, key, position, alternate):
         """ If this key is mapped to an action, execute the corresponding
         action and return the response. """
-        if key in self.__mapping:
-            return self.__mapping[key].execute_position(position, alternate)
-        return InputResponse()
+        return self.__execute(key, "execute_position", position, alternate)
 
     def execute_linear(self, key, value):
         """ If this key is mapped to an action, execute the corresponding
         action and return the response. """
+        return self.__execute(key, "execute_linear", value)
+
+    def __execute(self, key, method, *args):
+        """ Call an execute method of the action the key is mapped to. """
         if key in self.__mapping:
-            return self.__mapping[key].execute_linear(value)
+            action = self.__mapping[key]
+            if self.__on_execute is not None:
+                self.__on_execute(action, method, args)
+            return getattr(action, method)(*args)
         return InputResponse()
 
     def print_keybindings(self, key_display_func):
@@ -250,6 +269,9 @@ class InputHandling(object):
         # The actions table.
         self.__actions = Actions(self)
 
+        # Records the actions performed, if set.
+        self.__recorder = None
+
         # Keyboard controls.
         self.__kmap = KeyMap("Keyboard", {
             pygame.K_w: self.__actions.MOVE_FORWARDS,
@@ -266,34 +288,34 @@ class InputHandling(object):
             pygame.K_PAUSE: self.__actions.TOGGLE_PAUSE,
             pygame.K_BACKQUOTE: self.__actions.STEP,
             pygame.K_F11: self.__actions.SHOW_KEYS,
-        })
+        }, self.__record)
 
         # Joystick (button) controls.
         self.__js_map = KeyMap("Joystick buttons", {
             4: self.__actions.ROTATE_CLOCKWISE,
             5: self.__actions.ROTATE_ANTICLOCKWISE,
-        })
+        }, self.__record)
 
         # Joystick (axis) controls.
-        self.__js_axis_map = KeyMap("Joystick axes", {})
+        self.__js_axis_map = KeyMap("Joystick axes", {}, self.__record)
 
         # Joystick (ball) controls.
-        self.__js_ball_map = KeyMap("Joystick balls", {})
+        self.__js_ball_map = KeyMap("Joystick balls", {}, self.__record)
 
         # Joystick (hat) controls.
-        self.__js_hat_map = KeyMap("Joystick hats", {})
+        self.__js_hat_map = KeyMap("Joystick hats", {}, self.__record)
 
         # Mouse controls.
         self.__mouse_map = KeyMap("Mouse", {
             1: self.__actions.SHOOT,
             4: self.__actions.ZOOM_IN,
             5: self.__actions.ZOOM_OUT,
-        })
+        }, self.__record)
 
         # Mouse motion.
         self.__mouse_motion_map = KeyMap("Mouse motion", {
             1: self.__actions.SHOOT
-        })
+        }, self.__record)
 
         self.__zoom_increment = 0.03
 
@@ -318,6 +340,7 @@ class InputHandling(object):
 
         if e.type == pygame.QUIT:
             # Quit requested from window manager.
+            self.__record(self.__actions.QUIT, "execute", (True,))
             return self.__actions.QUIT.execute(True)
         elif e.type == pygame.KEYDOWN or e.type == pygame.KEYUP:
             return self.__kmap.execute(e.key, e.type == pygame.KEYUP)
@@ -344,6 +367,28 @@ class InputHandling(object):
 
         return InputResponse()
 
+    def set_recorder(self, recorder):
+        """ Record the actions performed with an ActionRecorder, or stop
+        recording if 'recorder' is None. """
+        self.__recorder = recorder
+
+    def __record(self, action, method, args):
+        """ Pass an action that's about to be executed to the recorder. """
+        if self.__recorder is not None:
+            self.__recorder.record(action.name, method, args)
+
+    def replay(self, actions):
+        """ Execute a list of recorded actions, as given by ActionReplay, and
+        return the combined response. """
+        ret = InputResponse()
+        for (name, method, args) in actions:
+            action = getattr(self.__actions, name)
+            self.__record(action, method, args)
+            response = getattr(action, method)(*args)
+            ret.event_handled = ret.event_handled or response.event_handled
+            ret.quit_requested = ret.quit_requested or response.quit_requested
+        return ret
+
     def zoom_in(self):
         """ Zoom the camera in."""
         cameras = self.game_services.get_entity_manager().query(Camera)
@@ -400,4 +445,47 @@ class InputHandling(object):
     def maintain_aim(self, point):
         """ Keep aiming at the given point. """
         if self.__shooting:
-            self.start_shooting(point)
\ No newline at end of file
+            self.start_shooting(point)
+
+
+class ActionRecorder(object):
+    """ Writes the actions performed on each tick to a file, along with the
+    seed. The file has a header line giving the seed and then one line of JSON
+    per action: the tick, the action name, the execute method and its
+    arguments. Lines are written as they happen, so the recording survives a
+    crash. """
+
+    def __init__(self, filename, seed):
+        """ Constructor. Set 'tick' before actions are recorded. """
+        self.tick = 0
+        self.__file = open(filename, "w")
+        self.__file.write("seed %s\n" % seed)
+
+    def record(self, name, method, args):
+        """ Record an action on the current tick. """
+        self.__file.write(json.dumps([self.tick, name, method, list(args)]))
+        self.__file.write("\n")
+        self.__file.flush()
+
+    def close(self):
+        """ Finish recording. """
+        self.__file.close()
+
+
+class ActionReplay(object):
+    """ Reads back a recording made by an ActionRecorder. """
+
+    def __init__(self, filename):
+        """ Constructor. """
+        self.__actions = collections.defaultdict(list)
+        with open(filename, "r") as f:
+            self.seed = int(f.readline().split()[1])
+            for line in f:
+                (tick, name, method, args) = json.loads(line)
+                args = [tuple(a) if isinstance(a, list) else a for a in args]
+                self.__actions[tick].append((str(name), str(method), args))
+
+    def actions_at(self, tick):
+        """ Get the (name, method, arguments) of the actions performed on a
+        tick. """
+        return self.__actions.get(tick, [])
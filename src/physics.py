@@ -1,7 +1,7 @@
 """
 Physics system & related code.
 
-The Physics system manages Body and Joint components. The system maintains a
+The Physics system manages Body, Joint and Attachment components. The system maintains a
 mapping between objects in a pymunk physics simulation and the logical
 components attached to entities (which are what get serialised.) The relevant
 data is copied back and forth between the simulation and the game state
@@ -10,11 +10,16 @@ periodically to keep them in sync.
 
 
 from .ecs import ComponentSystem, Component
+from .config import Config
 from .utils import Vec2d
-from .components import Body, Joint
+from .components import Body, Joint, Attachment, Projectile, Effect, \
+    get_team
 
 import pymunk
 import math
+import multiprocessing
+import sys
+from collections import OrderedDict
 
 
 class Physics(ComponentSystem):
@@ -31,10 +36,17 @@ class Physics(ComponentSystem):
         an update, while the updated simulation will be copied back to the
         components at the end of each update(). """
 
-        def __init__(self, body_component):
-            """ Constructor. """
+        def __init__(self, body_component, is_kinematic=False):
+            """ Constructor. Kinematic bodies are moved by us rather than by
+            the simulation; they push other bodies but aren't pushed. """
 
             self.entity = body_component.entity
+            self.is_kinematic = is_kinematic
+
+            # The moment is fixed by the mass and size we're created with, so
+            # we can only be recycled for bodies that match them.
+            self.pool_key = Physics.PymunkBodyPool.key(body_component,
+                                                       is_kinematic)
 
             # Moment of inertia.
             moment = pymunk.moment_for_circle(
@@ -44,15 +56,28 @@ class Physics(ComponentSystem):
             )
 
             # Initialise body and shape.
-            self.body = pymunk.Body(float(body_component.mass), moment)
+            if is_kinematic:
+                self.body = pymunk.Body(body_type=pymunk.Body.KINEMATIC)
+            else:
+                self.body = pymunk.Body(float(body_component.mass), moment)
             self.shape = pymunk.Circle(self.body, float(body_component.size))
             self.shape.friction = 0.8
 
-            # Collision type for non-collidable bodies.
-            if body_component.is_collideable:
-                self.shape.collision_type = 1
-            else:
-                self.shape.collision_type = 0
+            # The collision mask records which of the component types that
+            # collision handlers are interested in our entity has; see
+            # resolve_collision_mask(). We keep the components themselves
+            # too, so collision callbacks needn't look them up.
+            self.collision_mask = 0
+            self.handler_components = {}
+            self.shape.collision_type = self.collision_type(body_component)
+
+            # The shape filter is derived from the team and whether we are
+            # collideable; see resolve_collision_filter().
+            self.is_collideable = None
+
+            # The component state as of the last copy_to_component(), so we
+            # can tell whether game code has written to a sleeping body.
+            self.synced_state = None
 
             # Squirell ourself away inside the shape, so we can map back
             # later. Note that we're modifying the shape with a new field on
@@ -61,82 +86,285 @@ class Physics(ComponentSystem):
             # pymunk.Shape and extend it, just without all the code...
             self.shape.game_body = self
 
-        def copy_from_component(self):
-            """ Copy body data from components to simulation. """
+        def reset(self, body_component):
+            """ Recycle the simulation body for a new logical body. The state
+            is overwritten by copy_from_component(), except for the forces
+            and the collision data, which are cleared here. """
+            self.entity = body_component.entity
+            self.body.force = (0, 0)
+            self.body.torque = 0
+            self.collision_mask = 0
+            self.handler_components = {}
+            self.shape.collision_type = self.collision_type(body_component)
+            self.is_collideable = None
+            self.synced_state = None
+
+        def collision_type(self, body_component):
+            """ Get the pymunk collision type for the shape. Non-collideable
+            bodies have collision type 0, otherwise the collision type
+            encodes the collision mask. """
+            if body_component.is_collideable:
+                return self.collision_mask + 1
+            return 0
+
+        def resolve_collision_mask(self, component_types, excluding=None):
+            """ Work out which of the given component types our entity has.
+            Bit i of the mask is set if it has a component of the i'th type.
+            The 'excluding' component is treated as absent, since it is
+            about to be removed. """
+            self.collision_mask = 0
+            self.handler_components = {}
+            for (i, t) in enumerate(component_types):
+                component = self.entity.get_component(t)
+                if component is not None and component is not excluding:
+                    self.collision_mask |= 1 << i
+                    self.handler_components[t] = component
+            body_component = self.entity.get_component(Body)
+            self.shape.collision_type = self.collision_type(body_component)
+
+        def resolve_collision_filter(self, collision_filter):
+            """ Set the shape filter, as given for our entity by the
+            'collision_filter' function. """
+            self.is_collideable = self.entity.get_component(Body).is_collideable
+            self.shape.filter = collision_filter(self.entity)
+
+        @staticmethod
+        def component_state(body_component):
+            """ Get the parts of a component that we copy back and forth. """
+            return (body_component.position.x,
+                    body_component.position.y,
+                    body_component.velocity.x,
+                    body_component.velocity.y,
+                    body_component.orientation,
+                    body_component.angular_velocity,
+                    body_component.mass,
+                    body_component.is_collideable)
+
+        def copy_from_component(self, collision_filter=None):
+            """ Copy body data from components to simulation. The shape
+            filter is refreshed if 'collision_filter' is given. Nothing is
+            written unless the component has changed since it was last
+            synced, since writes wake sleeping bodies. Returns whether the
+            body is awake. """
             body_component = self.entity.get_component(Body)
             pymunk_body = self
-            pymunk_body.body.position = body_component.position
-            pymunk_body.body.velocity = body_component.velocity
-            #pymunk_body.shape.radius = body_component.size
-            pymunk_body.body.mass = body_component.mass
-            if body_component.is_collideable:
-                pymunk_body.shape.collision_type = 1
-            else:
-                pymunk_body.shape.collision_type = 0
-            pymunk_body.body.angle = math.radians(
-                body_component.orientation)
-            pymunk_body.body.angular_velocity = math.radians(
-                body_component.angular_velocity)
-            for (force, local_point) in body_component.impulses:
-                pymunk_body.body.apply_force_at_local_point(force, local_point)
+            state = Physics.PymunkBody.component_state(body_component)
+            if state != pymunk_body.synced_state:
+                if collision_filter is not None and \
+                   body_component.is_collideable != pymunk_body.is_collideable:
+                    pymunk_body.resolve_collision_filter(collision_filter)
+                pymunk_body.body.position = body_component.position
+                pymunk_body.body.velocity = body_component.velocity
+                #pymunk_body.shape.radius = body_component.size
+                if not pymunk_body.is_kinematic:
+                    pymunk_body.body.mass = body_component.mass
+                pymunk_body.shape.collision_type = \
+                    pymunk_body.collision_type(body_component)
+                pymunk_body.body.angle = math.radians(
+                    body_component.orientation)
+                pymunk_body.body.angular_velocity = math.radians(
+                    body_component.angular_velocity)
+            if not pymunk_body.is_kinematic:
+                for (force, local_point) in body_component.impulses:
+                    pymunk_body.body.apply_force_at_local_point(force,
+                                                                local_point)
+            return not pymunk_body.body.is_sleeping
 
         def copy_to_component(self):
-            """ Copy simulation state back to components """
-            body_component = self.entity.get_component(Body)
+            """ Copy simulation state back to components. Sleeping bodies
+            haven't moved, so there's nothing to copy. """
             pymunk_body = self
+            if pymunk_body.body.is_sleeping:
+                return
+            body_component = self.entity.get_component(Body)
             body_component.position = pymunk_body.body.position
             body_component.velocity = pymunk_body.body.velocity
             body_component.size = pymunk_body.shape.radius
-            body_component.mass = pymunk_body.body.mass
-            body_component.is_collideable = pymunk_body.shape.collision_type == 1
+            if not pymunk_body.is_kinematic:
+                body_component.mass = pymunk_body.body.mass
+            body_component.is_collideable = pymunk_body.shape.collision_type != 0
             body_component.orientation = math.degrees(
                 pymunk_body.body.angle)
             body_component.angular_velocity = math.degrees(
                 pymunk_body.body.angular_velocity)
             body_component.impulses = []
+            pymunk_body.synced_state = \
+                Physics.PymunkBody.component_state(body_component)
+
+    class PymunkBodyPool(object):
+        """ Recycles simulation bodies, which are expensive to create. Bodies
+        are pooled by the mass and size they were created with and whether
+        they're kinematic, and the pool keeps a bounded number of each. """
+
+        def __init__(self, max_free_per_key=64):
+            """ Constructor. """
+            self.__free = {}
+            self.__max_free_per_key = max_free_per_key
+            self.__hits = 0
+            self.__misses = 0
+
+        @staticmethod
+        def key(body_component, is_kinematic):
+            """ Get the pool key for a logical body. """
+            return (float(body_component.mass),
+                    float(body_component.size),
+                    is_kinematic)
+
+        def take(self, body_component, is_kinematic):
+            """ Get a simulation body for a logical body, reusing a free one
+            if we have one. """
+            free = self.__free.get(self.key(body_component, is_kinematic))
+            if free:
+                self.__hits += 1
+                pymunk_body = free.pop()
+                pymunk_body.reset(body_component)
+                return pymunk_body
+            self.__misses += 1
+            return Physics.PymunkBody(body_component, is_kinematic)
+
+        def give(self, pymunk_body):
+            """ Return a simulation body that's no longer in use. """
+            pymunk_body.entity = None
+            pymunk_body.handler_components = {}
+            free = self.__free.setdefault(pymunk_body.pool_key, [])
+            if len(free) < self.__max_free_per_key:
+                free.append(pymunk_body)
+
+        def stats(self):
+            """ Get a dictionary of statistics about the pool. """
+            return {
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "free": sum(len(free) for free in self.__free.values()),
+                "keys": len(self.__free)
+            }
 
     class PymunkBodyMapping(object):
         """ Manages the mapping between Body components and simulation 
-        objects. """
+        objects. The mapping is maintained incrementally: bodies are queued
+        for creation when their component is added, and are created at the
+        start of the next update. They are removed when their component
+        goes away. """
 
-        def __init__(self, space):
+        def __init__(self, space, collision_component_types, collision_filter):
             """ Constructor. """
             self.__mapping = {}
+            self.__pending = OrderedDict()
             self.__space = space
+            self.__pool = Physics.PymunkBodyPool()
+            self.__awake_count = 0
+            self.__forces = []
+            self.__collision_component_types = collision_component_types
+            self.__collision_filter = collision_filter
 
         def __getitem__(self, item):
             """ Look up a pymunk body from an entity. """
             return self.__mapping[item]
 
-        def update(self, entities):
-            """ Update the mapping, creating new simulation bodies where needed
-            and deleting ones that we are done with. """
-
-            # The set of entities that need a corresponding simulation
-            # object. We remove entities where we see them, and create
-            # simulation objects where necessary.
-            to_remove = set(self.__mapping.keys())
-            for e in entities:
-                if e in to_remove:
-                    to_remove.remove(e)
-                else:
-                    body = e.get_component(Body)
-                    assert body
-                    pymunk_body = Physics.PymunkBody(body)
-                    self.__mapping[e] = pymunk_body
-                    self.__space.add(pymunk_body.body, pymunk_body.shape)
-
-            # Now, the set contains all of the entities that had simulation
-            # bodies but shouldn't any more.
-            for e in to_remove:
-                pymunk_body = self.__mapping[e]
+        def __contains__(self, item):
+            """ Does the entity have a simulation body? """
+            return item in self.__mapping
+
+        def add(self, entity):
+            """ Queue creation of a simulation body for an entity. """
+            if not entity in self.__mapping:
+                self.__pending[entity] = True
+
+        def remove(self, entity):
+            """ Remove the simulation body of an entity, if it has one. """
+            self.__pending.pop(entity, None)
+            pymunk_body = self.__mapping.pop(entity, None)
+            if pymunk_body is not None:
                 self.__space.remove(pymunk_body.body, pymunk_body.shape)
-                del self.__mapping[e]
+                self.__pool.give(pymunk_body)
+
+        def resolve(self, entity, excluding=None):
+            """ Recompute the collision mask of an entity's body. """
+            pymunk_body = self.__mapping.get(entity)
+            if pymunk_body is not None:
+                pymunk_body.resolve_collision_mask(
+                    self.__collision_component_types,
+                    excluding
+                )
+
+        def resolve_all(self):
+            """ Recompute the collision masks of all bodies. """
+            for entity in self.__mapping:
+                self.resolve(entity)
+
+        def resolve_filter(self, entity):
+            """ Recompute the shape filter of an entity's body. """
+            pymunk_body = self.__mapping.get(entity)
+            if pymunk_body is not None:
+                pymunk_body.resolve_collision_filter(self.__collision_filter)
+
+        def clear(self):
+            """ Remove all simulation bodies. """
+            for entity in list(self.__mapping.keys()):
+                self.remove(entity)
+            self.__pending.clear()
+
+        def flush(self):
+            """ Create simulation bodies for the entities queued by add().
+            Projectiles and effects are moved by the ProjectileSystem and
+            EffectSystem, so they don't get simulation bodies. Attached bodies are positioned from their
+            parents, so they only get kinematic bodies, and only if they can
+            collide. Dormant entities stay queued until they're activated. """
+            dormant = [e for e in self.__pending if e.is_dormant]
+            for e in self.__pending:
+                if e.is_dormant:
+                    continue
+                if e.is_garbage or e.has_component(Projectile) or \
+                   e.has_component(Effect):
+                    continue
+                body = e.get_component(Body)
+                if body is None:
+                    continue
+                is_attached = e.has_component(Attachment)
+                if is_attached and not body.is_collideable:
+                    continue
+                pymunk_body = self.__pool.take(body, is_attached)
+                pymunk_body.resolve_collision_mask(
+                    self.__collision_component_types
+                )
+                pymunk_body.resolve_collision_filter(self.__collision_filter)
+                self.__mapping[e] = pymunk_body
+                self.__space.add(pymunk_body.body, pymunk_body.shape)
+            self.__pending = OrderedDict((e, True) for e in dormant)
+
+        def pool_stats(self):
+            """ Get statistics about the pool of simulation bodies. """
+            return self.__pool.stats()
+
+        def sleep_stats(self):
+            """ Get the numbers of awake and sleeping bodies, as of the last
+            copy_from_components(). """
+            return (self.__awake_count,
+                    len(self.__mapping) - self.__awake_count)
 
         def copy_from_components(self):
-            """ Copy body data from components to simulation. """
+            """ Copy body data from components to simulation. The forces
+            applied to each body are recorded, so that reapply_forces() can
+            put them back. """
+            self.__awake_count = 0
+            self.__forces = []
             for entity in self.__mapping:
-                self.__mapping[entity].copy_from_component()
+                pymunk_body = self.__mapping[entity]
+                if pymunk_body.copy_from_component(self.__collision_filter):
+                    self.__awake_count += 1
+                if not pymunk_body.is_kinematic and \
+                   len(entity.get_component(Body).impulses) > 0:
+                    self.__forces.append((pymunk_body.body,
+                                          pymunk_body.body.force,
+                                          pymunk_body.body.torque))
+
+        def reapply_forces(self):
+            """ Put back the forces applied by copy_from_components(). Pymunk
+            clears forces after each step, so this is needed before each
+            substep after the first. """
+            for (body, force, torque) in self.__forces:
+                body.force = force
+                body.torque = torque
 
         def copy_to_components(self):
             """ Copy simulation state back to components """
@@ -145,107 +373,369 @@ class Physics(ComponentSystem):
 
     class PymunkJointMapping(object):
         """ Manages the mapping between Joint components and physical joints
-        between physical bodies. """
+        between physical bodies. Like the body mapping, this is maintained
+        incrementally. """
 
         def __init__(self, space, pymunk_body_mapping):
             """ Constructor. """
             self.__space = space
             self.__pymunk_bodies = pymunk_body_mapping
             self.__mapping = {}
-
-        def update(self, entities):
-            """ Update the mapping. """
-
-            # If a joint no longer has correspond entities, then delete the
-            # joint.
-            for e in entities:
-                joint = e.get_component(Joint)
-                if joint.entity_a.entity is None or \
-                                joint.entity_b.entity is None:
-                    e.kill()
-                    entities.remove(e)
+            self.__pending = OrderedDict()
+
+            # Map from body entity to the joint entities attached to it, so
+            # that we can tear down joints when a body goes away.
+            self.__joints_by_body = {}
+
+        def add(self, entity):
+            """ Queue creation of a simulation joint for an entity. """
+            if not entity in self.__mapping:
+                self.__pending[entity] = True
+
+        def remove(self, entity):
+            """ Remove the simulation joint of an entity, if it has one. """
+            self.__pending.pop(entity, None)
+            item = self.__mapping.pop(entity, None)
+            if item is not None:
+                (joint, bodies) = item
+                self.__space.remove(joint)
+                for body_entity in bodies:
+                    joints = self.__joints_by_body.get(body_entity)
+                    if joints is not None:
+                        joints.discard(entity)
+                        if len(joints) == 0:
+                            del self.__joints_by_body[body_entity]
+
+        def remove_body(self, body_entity):
+            """ A body has gone away, so kill the joints attached to it. """
+            for e in list(self.__joints_by_body.get(body_entity, ())):
+                self.remove(e)
+                e.kill()
+
+        def clear(self):
+            """ Remove all simulation joints. """
+            for entity in list(self.__mapping.keys()):
+                self.remove(entity)
+            self.__pending.clear()
+
+        def flush(self):
+            """ Create simulation joints for the entities queued by add(). If
+            a joint no longer has corresponding bodies, then kill it. Dormant
+            joints stay queued until they're activated. """
+            dormant = [e for e in self.__pending if e.is_dormant]
+            for e in self.__pending:
+                if e.is_dormant:
                     continue
-
-            # Create simulation joints.
-            to_remove = set(self.__mapping.keys())
-            for e in entities:
                 component = e.get_component(Joint)
+                if e.is_garbage or component is None:
+                    continue
                 e1 = component.entity_a.entity
                 e2 = component.entity_b.entity
-                if not e in to_remove:
-                    joint = pymunk.constraint.PinJoint(
-                        self.__pymunk_bodies[e1].body,
-                        self.__pymunk_bodies[e2].body,
-                        component.entity_a_local_point,
-                        component.entity_b_local_point
-                    )
-                    joint.collide_bodies = False
-                    self.__mapping[e] = joint
-                    self.__space.add(joint)
-                else:
-                    to_remove.remove(e)
-
-            # Delete simulation joints.
-            for e in to_remove:
-                joint = self.__mapping[e]
-                self.__space.remove(joint)
-                del self.__mapping[e]
-
-    def __init__(self):
-        """ Initialise physics. """
+                if e1 not in self.__pymunk_bodies or \
+                   e2 not in self.__pymunk_bodies:
+                    e.kill()
+                    continue
+                joint = pymunk.constraint.PinJoint(
+                    self.__pymunk_bodies[e1].body,
+                    self.__pymunk_bodies[e2].body,
+                    component.entity_a_local_point,
+                    component.entity_b_local_point
+                )
+                joint.collide_bodies = False
+                self.__mapping[e] = (joint, (e1, e2))
+                self.__space.add(joint)
+                for body_entity in (e1, e2):
+                    self.__joints_by_body.setdefault(body_entity, set()).add(e)
+            self.__pending = OrderedDict((e, True) for e in dormant)
+
+    def __init__(self, config=None):
+        """ Initialise physics. The config sets the quality of the
+        simulation; see the 'physics' section of base_config.txt. Bodies
+        that have moved slower than the idle speed for the sleep time
+        threshold (in seconds) are put to sleep, and cost next to nothing
+        until something wakes them. """
         ComponentSystem.__init__(self, [Body])
+        if config is None:
+            config = Config()
 
         # List of collision handlers. These operate in terms of types of
-        # entity. We implement them using a pymunk collision handler.
+        # component. Each component type a handler is interested in is
+        # assigned a bit, and each body is resolved into a mask of the types
+        # its entity has. The dispatch table maps pairs of masks to the
+        # handlers that apply to them, and a pymunk collision handler is
+        # registered only for those pairs - other contacts never call back
+        # into Python.
         self.__collision_handlers = []
-
-        # The pymunk space.
-        self.__space = pymunk.Space()
+        self.__collision_component_types = []
+        self.__collision_dispatch = {}
+
+        # The pymunk space. Pymunk's threaded solver isn't available on
+        # Windows, so we quietly fall back to the plain one there.
+        threaded = config.get_or_default("threaded", False) and \
+            sys.platform != "win32"
+        self.__space = pymunk.Space(threaded=threaded)
+        if threaded:
+            threads = config.get_or_default("threads", 0)
+            if threads <= 0:
+                threads = multiprocessing.cpu_count()
+            self.__space.threads = threads
+        self.__space.iterations = config.get_or_default("iterations", 10)
+        self.__space.collision_slop = config.get_or_default("collision_slop",
+                                                            0.1)
+        self.__space.sleep_time_threshold = config.get_or_default(
+            "sleep_time_threshold", 0.5)
+        self.__space.idle_speed_threshold = config.get_or_default(
+            "idle_speed_threshold", 1.0)
+        self.__substeps = config.get_or_default("substeps", 1)
+
+        # The broadphase is either the default bounding box tree, a spatial
+        # hash, or 'auto' to choose between them from the body sizes. The
+        # hash cell size is derived from the body sizes unless it's given.
+        # Tuning happens at the start of the next update, once queued bodies
+        # have been added.
+        self.__broadphase = config.get_or_default("broadphase", "tree")
+        assert self.__broadphase in ("tree", "spatial_hash", "auto")
+        self.__spatial_hash_cell_size = config.get_or_none(
+            "spatial_hash_cell_size")
+        self.__want_tune = self.__broadphase != "tree"
+        self.__uses_spatial_hash = False
 
         # Note: the this function assumes we have snuck a reference to our
         # own body into the pymunk shape. Which we have: see Body(). Here
-        # we try each handler in turn till we find one that is compatible.
+        # we try each handler for the pair of masks till we find one that
+        # handles the collision.
         def collide_begin(arbiter, space, data):
-            go1 = arbiter.shapes[0].game_body.entity
-            go2 = arbiter.shapes[1].game_body.entity
-            for handler in self.__collision_handlers:
-                result = handler.handle_collision(go1, go2)
+            b1 = arbiter.shapes[0].game_body
+            b2 = arbiter.shapes[1].game_body
+            key = (b1.collision_mask, b2.collision_mask)
+            for (handler, swapped) in self.__collision_dispatch.get(key, ()):
+                (first, second) = (b2, b1) if swapped else (b1, b2)
+                result = handler.handle_matching_collision(
+                    first.handler_components[handler.t1],
+                    second.handler_components[handler.t2]
+                )
                 if result.handled:
                     return result.wants_physical_simulation
             return True
+        self.__collide_begin = collide_begin
 
-        # Setup our simple pymunk collision handler.
-        self.__pymunk_handler = self.__space.add_collision_handler(1, 1)
-        self.__pymunk_handler.begin = lambda a, s, d: collide_begin(a, s, d)
-
-        # Setup a default handler for non-collideable objects.
-        self.__default_handler = self.__space.add_default_collision_handler()
-        self.__default_handler.begin = lambda a, s, d: False
+        # Each team is assigned a shape filter category bit as it is first
+        # seen. Shape filters stop teams colliding with themselves, and stop
+        # non-collideable bodies colliding at all, before the narrow phase.
+        self.__team_filters = {}
 
         # Map Body and Joint components to simulation objects.
-        self.__pymunk_bodies = Physics.PymunkBodyMapping(self.__space)
+        self.__pymunk_bodies = Physics.PymunkBodyMapping(
+            self.__space,
+            self.__collision_component_types,
+            self.collision_filter
+        )
         self.__pymunk_joints = Physics.PymunkJointMapping(self.__space,
                                                           self.__pymunk_bodies)
 
+        # Attachment components, in the order they were added so that parents
+        # that are themselves attached are positioned before their children.
+        self.__attachments = OrderedDict()
+
+    def matches(self, component_type):
+        """ We manage Joint and Attachment components as well as Bodies, and
+        need to know about the components that collision handlers are
+        interested in. """
+        return component_type == Body or component_type == Joint or \
+            component_type == Attachment or \
+            component_type in self.__collision_component_types
+
+    def on_component_add(self, component):
+        """ Queue the creation of the corresponding simulation object. """
+        if component.__class__ == Body:
+            self.__pymunk_bodies.add(component.entity)
+        elif component.__class__ == Joint:
+            self.__pymunk_joints.add(component.entity)
+        elif component.__class__ == Attachment:
+            self.__attachments[component.entity] = component
+        elif component.__class__ in self.__collision_component_types:
+            self.__pymunk_bodies.resolve(component.entity)
+
+    def on_component_remove(self, component):
+        """ Remove the corresponding simulation object. Joints attached to a
+        body that goes away are removed along with it. """
+        if component.__class__ == Body:
+            self.__pymunk_joints.remove_body(component.entity)
+            self.__pymunk_bodies.remove(component.entity)
+        elif component.__class__ == Joint:
+            self.__pymunk_joints.remove(component.entity)
+        elif component.__class__ == Attachment:
+            self.__attachments.pop(component.entity, None)
+        elif component.__class__ in self.__collision_component_types:
+            self.__pymunk_bodies.resolve(component.entity, component)
+
+    def on_load(self):
+        """ The entity manager has been restored from a save, so rebuild the
+        simulation from scratch. """
+        self.__pymunk_joints.clear()
+        self.__pymunk_bodies.clear()
+        entity_manager = self.game_services.get_entity_manager()
+        for entity in entity_manager.query_include_queued(Body):
+            self.__pymunk_bodies.add(entity)
+        for entity in entity_manager.query_include_queued(Joint):
+            self.__pymunk_joints.add(entity)
+        self.__attachments.clear()
+        for entity in entity_manager.query_include_queued(Attachment):
+            self.__attachments[entity] = entity.get_component(Attachment)
+
+    def collision_filter(self, entity):
+        """ Get the filter determining what an entity collides with. Bodies
+        that aren't collideable collide with nothing. Otherwise the entity is
+        in the category for its team and does not collide with the rest of
+        its team. Entities without a team collide with everything. The
+        filter should be treated as an opaque object. """
+        body = entity.get_component(Body)
+        if body is None or not body.is_collideable:
+            return pymunk.ShapeFilter(categories=0, mask=0)
+        team = get_team(entity)
+        if not team in self.__team_filters:
+            assert len(self.__team_filters) < 32
+            category = 1 << len(self.__team_filters)
+            mask = pymunk.ShapeFilter.ALL_MASKS
+            if team is not None:
+                mask ^= category
+            self.__team_filters[team] = pymunk.ShapeFilter(
+                categories=category,
+                mask=mask
+            )
+        return self.__team_filters[team]
+
+    def pool_stats(self):
+        """ Get a dictionary of statistics about the recycling of simulation
+        bodies: 'hits' and 'misses' count the bodies that were and weren't
+        recycled, 'free' is how many are waiting to be reused, and 'keys' is
+        how many kinds of body are pooled. """
+        return self.__pymunk_bodies.pool_stats()
+
+    def tune_broadphase(self):
+        """ Re-tune the broadphase from the sizes of the bodies present at
+        the next update, e.g. because a new wave has been spawned. This only
+        has an effect if the broadphase is 'auto', or is a spatial hash with
+        no cell size given. """
+        if self.__broadphase != "tree":
+            self.__want_tune = True
+
+    def __tune_broadphase(self):
+        """ Choose the broadphase from the distribution of body sizes. A
+        spatial hash works best when the bodies are a similar size, with
+        cells big enough that most bodies only overlap a few of them. Pymunk
+        can't switch back to the tree, so once 'auto' has chosen the spatial
+        hash it only adjusts the cell size. A spatial hash with a given cell
+        size doesn't need any bodies to sample, but otherwise tuning waits
+        until there are some. """
+        sizes = sorted(shape.radius for shape in self.__space.shapes)
+        if len(sizes) == 0:
+            if self.__broadphase == "spatial_hash" and \
+               self.__spatial_hash_cell_size is not None and \
+               not self.__uses_spatial_hash:
+                self.__space.use_spatial_hash(self.__spatial_hash_cell_size,
+                                              1000)
+                self.__uses_spatial_hash = True
+            return
+        self.__want_tune = False
+        median = sizes[len(sizes) // 2]
+        high = sizes[(len(sizes) * 9) // 10]
+        if self.__broadphase == "auto" and high > 4 * median and \
+           not self.__uses_spatial_hash:
+            return
+        cell_size = self.__spatial_hash_cell_size
+        if cell_size is None:
+            cell_size = 2 * high
+        self.__space.use_spatial_hash(cell_size, max(1000, 10 * len(sizes)))
+        self.__uses_spatial_hash = True
+
+    def sleep_stats(self):
+        """ Get the numbers of awake and sleeping bodies. """
+        return self.__pymunk_bodies.sleep_stats()
+
+    def update_team(self, entity):
+        """ The team of an entity has changed, so update what it can
+        collide with. """
+        self.__pymunk_bodies.resolve_filter(entity)
+
     def add_collision_handler(self, handler):
         """ Add a logical collision handler for the game. """
         self.__collision_handlers.append(handler)
+        for t in (handler.t1, handler.t2):
+            if not t in self.__collision_component_types:
+                self.__collision_component_types.append(t)
+        self.__build_collision_dispatch()
+        self.__pymunk_bodies.resolve_all()
+
+    def __build_collision_dispatch(self):
+        """ Build the table mapping pairs of collision masks to the handlers
+        that apply to them, in the order they were added. Each entry records
+        whether the handler's types match the bodies the other way round. A
+        pymunk handler is registered for each pair with an entry. """
+        types = self.__collision_component_types
+        def has(mask, t):
+            return mask & (1 << types.index(t)) != 0
+        self.__collision_dispatch = {}
+        num_masks = 1 << len(types)
+        for m1 in range(num_masks):
+            for m2 in range(num_masks):
+                entries = []
+                for handler in self.__collision_handlers:
+                    if has(m1, handler.t1) and has(m2, handler.t2):
+                        entries.append((handler, False))
+                    elif has(m2, handler.t1) and has(m1, handler.t2):
+                        entries.append((handler, True))
+                if len(entries) == 0:
+                    continue
+                self.__collision_dispatch[(m1, m2)] = entries
+                if m1 <= m2:
+                    pymunk_handler = self.__space.add_collision_handler(
+                        m1 + 1,
+                        m2 + 1
+                    )
+                    pymunk_handler.begin = self.__collide_begin
 
     def update(self, dt):
         """ Advance the simulation. """
 
-        # Update the body mapping & copy simulation state from the components.
-        self.__pymunk_bodies.update(self.entities())
+        # Create any simulation objects that have been queued since the last
+        # update & copy simulation state from the components.
+        self.__pymunk_bodies.flush()
+        self.__pymunk_joints.flush()
+        if self.__want_tune:
+            self.__tune_broadphase()
+        self.__update_attachments()
         self.__pymunk_bodies.copy_from_components()
-        self.__pymunk_joints.update(
-            self.game_services.get_entity_manager().query(Joint)
-        )
 
-        # Advance the simulation.
-        self.__space.step(dt)
+        # Advance the simulation, in substeps if we've been asked to.
+        # The forces are applied for the whole of the update, so they're put
+        # back for each substep.
+        for i in range(self.__substeps):
+            if i > 0:
+                self.__pymunk_bodies.reapply_forces()
+            self.__space.step(dt / self.__substeps)
 
-        # Copy simulation state back to components.
+        # Copy simulation state back to components, and put attached bodies
+        # back in place relative to where their parents ended up.
         self.__pymunk_bodies.copy_to_components()
+        self.__update_attachments()
+
+    def __update_attachments(self):
+        """ Position attached bodies from their parents' transforms, and
+        give them the velocity of the point they're attached to. Attached
+        bodies whose parent has gone are left where they are. """
+        for attachment in self.__attachments.values():
+            parent = attachment.parent.entity
+            body = attachment.entity.get_component(Body)
+            if parent is None or body is None:
+                continue
+            parent_body = parent.get_component(Body)
+            offset = attachment.position.rotated_degrees(
+                parent_body.orientation
+            )
+            body.position = parent_body.position + offset
+            body.velocity = parent_body.velocity + offset.perpendicular() * \
+                math.radians(parent_body.angular_velocity)
 
     def closest_body_with(self, point, f):
         """ Find the closest body of a given predicate. """
@@ -268,6 +758,23 @@ class Physics(ComponentSystem):
                 return body.entity
         return None
 
+    def get_entities_in_box(self, lower, upper):
+        """ Get the entities with simulation bodies that overlap the box with
+        the given lower left and upper right corners. """
+        shapes = self.__space.bb_query(
+            pymunk.BB(float(lower[0]), float(lower[1]),
+                      float(upper[0]), float(upper[1])),
+            pymunk.ShapeFilter()
+        )
+        entities = []
+        seen = set()
+        for shape in shapes:
+            entity = shape.game_body.entity
+            if entity is not None and not entity in seen:
+                seen.add(entity)
+                entities.append(entity)
+        return entities
+
     def hit_scan(
         self,
         from_entity,
@@ -292,6 +799,26 @@ class Physics(ComponentSystem):
                 return (hit_entity, result.point, result.normal)
         return (None, end, None)
 
+    def sweep(self, start, end, radius, collision_filter):
+        """ Find the bodies hit by a circle of the given radius moving from
+        start to end, for something with the given collision filter (see
+        collision_filter().) Return: [(entity, pos, normal)], nearest
+        first. """
+        results = self.__space.segment_query(start, end, radius, collision_filter)
+        results.sort(key=lambda result: result.alpha)
+        return [(result.shape.game_body.entity, result.point, result.normal)
+                for result in results if result.shape is not None]
+
+    def handle_collision(self, entity_a, entity_b):
+        """ Apply the logical collision handlers to a pair of entities that
+        have come into contact outside of the simulation. Return the
+        CollisionResult of the handler that dealt with it, or None. """
+        for handler in self.__collision_handlers:
+            result = handler.handle_collision(entity_a, entity_b)
+            if result.handled:
+                return result
+        return None
+
     def world_to_local(self, entity, point):
         """ Convert a world point to local coordinates. """
         # Note: uses data from component for correctness since might not have
@@ -345,7 +872,9 @@ class CollisionResult(object):
 class CollisionHandler(object):
     """ A logical collision handler. While physical collision handling is
     dealt with by the physics implementation, game components must be added
-    by adding instances of this matching entity types. """
+    by adding instances of this matching entity types. The Physics system
+    dispatches to handle_matching_collision() directly for bodies whose
+    entities have components of the matching types. """
 
     def __init__(self, t1, t2):
         """ Initialise with a pair of types. """
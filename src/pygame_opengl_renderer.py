@@ -309,6 +309,10 @@ class AnimFrames(object):
         """ Constructor. """
         self.__frames = frames
 
+    def __len__(self):
+        """ The number of frames. """
+        return len(self.__frames)
+
     def get_size(self):
         """ The texture size. """
         return (self.get_width(), self.get_height())
@@ -1143,6 +1147,18 @@ class PygameOpenGLRenderer(Renderer):
                         orientation=orientation,
                         **kwargs)
 
+    def render_particles(self, frames, positions, frame_indices, **kwargs):
+        """ Render a batch of particles. """
+        (coords, level) = self.__parse_kwargs(kwargs)
+        buffer = self.__command_buffers.get_buffer(coords, level, GL.GL_TRIANGLES)
+        for (position, index) in zip(positions.tolist(), frame_indices.tolist()):
+            texref = frames.get_frame_by_index(index)
+            buffer.add_quad(position,
+                            texref.get_size(),
+                            texref=texref,
+                            orientation=0,
+                            **kwargs)
+
     def render_image(self, position, image, **kwargs):
         """ Render an image. """
         (coords, level) = self.__parse_kwargs(kwargs)
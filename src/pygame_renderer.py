@@ -164,6 +164,24 @@ class PygameRenderer(Renderer):
             self.__surface.blit(img, screen_pos)
         self.__add_job((level, coords), do_it)
 
+    def render_particles(self, frames, positions, frame_indices, **kwargs):
+        """ Render a batch of particles. Each frame is scaled once. """
+        (coords, level) = self.__parse_kwargs(kwargs)
+        particles = zip(positions.tolist(), frame_indices.tolist())
+        def do_it(view):
+            images = {}
+            for (position, index) in particles:
+                img = images.get(index)
+                if img is None:
+                    img = frames[index]
+                    if (view.zoom != 1):
+                        size = view.size_to_screen(img.get_size(), coords)
+                        img = pygame.transform.scale(img, (int(size[0]), int(size[1])))
+                    images[index] = img
+                screen_pos = view.point_to_screen(Vec2d(position), coords) - Vec2d(img.get_rect().center)
+                self.__surface.blit(img, screen_pos)
+        self.__add_job((level, coords), do_it)
+
     def render_image(self, position, image, **kwargs):
         """ Render an image. """
         (coords, level) = self.__parse_kwargs(kwargs)
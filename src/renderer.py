@@ -235,6 +235,14 @@ class Renderer(object):
                             coords=Renderer.COORDS_WORLD)
         self.render_animation(position, orientation, anim, **kwargs)
 
+    def add_job_particles(self, frames, positions, frame_indices, **kwargs):
+        """ Queue a job to render a batch of particles, given the frames of
+        their animation and arrays of their positions and frame indices. """
+        self.__set_defaults(kwargs,
+                            level=Renderer.LEVEL_MID,
+                            coords=Renderer.COORDS_WORLD)
+        self.render_particles(frames, positions, frame_indices, **kwargs)
+
     def add_job_image(self, position, image, **kwargs):
         """ Queue a job to render an image. """
         self.__set_defaults(kwargs,
@@ -288,6 +296,11 @@ class Renderer(object):
         """ Render an animation. """
         pass
 
+    @abc.abstractmethod
+    def render_particles(self, frames, positions, frame_indices, **kwargs):
+        """ Render a batch of particles. """
+        pass
+
     @abc.abstractmethod
     def render_image(self, position, image, **kwargs):
         """ Render an image. """
@@ -15,10 +15,15 @@ memory usage by only reading in a fraction of an animation's frames.
 To prevent stutter, all resources can be read at once using preload(),
 this will display a loading screen via the injected renderer and read
 all resources in the 'res' tree.
+
+The loader also holds the cache of thrust solutions shared by all ships. The
+solutions for each config's thrusters are worked out during preload(), and
+the cache can be kept in a file between runs.
 """
 
 from .config import Config
 from .loading_screen import LoadingScreen
+from .thrust import ThrustSolutionCache, thruster_layout
 from .utils import ordered_load, fromwin, Timer
 
 import pygame
@@ -36,6 +41,8 @@ class ResourceLoader(object):
         self.__fonts = {}
         self.__configs = {}
         self.__sounds = {}
+        self.__thrust_solutions = ThrustSolutionCache()
+        self.__thrust_solutions_file = None
 
     def set_renderer(self, renderer):
         """ Set the renderer to use to load images. """
@@ -45,6 +52,21 @@ class ResourceLoader(object):
         """ Minimise image loading. """
         self.__minimise_image_loading = yes
 
+    def set_thrust_solutions_file(self, filename):
+        """ Keep the thrust solutions in a file between runs. """
+        self.__thrust_solutions_file = filename
+        if filename is not None:
+            self.__thrust_solutions.load(filename)
+
+    def save_thrust_solutions(self):
+        """ Save the thrust solutions, if we're keeping them in a file. """
+        if self.__thrust_solutions_file is not None:
+            self.__thrust_solutions.save(self.__thrust_solutions_file)
+
+    def get_thrust_solutions(self):
+        """ Get the cache of thrust solutions. """
+        return self.__thrust_solutions
+
     def preload(self):
         """ Preload certain resources to reduce game stutter. """
 
@@ -69,6 +91,18 @@ class ResourceLoader(object):
             self.load_config_file(config)
             loading.increment()
 
+        # Work out the thrust solutions for anything with thrusters.
+        for config in configs:
+            components = self.load_config_file(config).get_or_none("components")
+            if components is None:
+                continue
+            thrusters = components.get_or_none("src.components.Thrusters")
+            if thrusters is None:
+                continue
+            layout = thruster_layout(thrusters.get_or_default("thrusters", []))
+            if len(layout) > 0:
+                self.__thrust_solutions.precompute(layout)
+
         # The renderer might like to return us proxy objects and initialise
         # them in one go, so let it do that.
         self.__renderer.post_preload()
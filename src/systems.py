@@ -23,7 +23,7 @@ entity 'follow' another, contains an entity reference - the tracked entity.
 'containing' component to store a list of entity references, while the
 'contained' components store a back reference to the 'containing' entity. Any
 'ownership' semantics are implemented on an ad hoc basis in the corresponding
-system. For instance an entity with the 'Thruster' component will kill itself
+system. For instance an entity with the 'Turret' component will kill itself
 when the entity it is attached to is killed.
 
 Some rules are implemented as free functions, since they are needed in multiple
@@ -36,10 +36,22 @@ from components import *
 from physics import Physics
 from direction_providers import *
 from renderer import Renderer
+from thrust import solve_thrusts
 
-import random
+import collections
 import numpy
-import scipy.optimize
+
+# Level of detail for work that can be done less often away from the
+# cameras: entities beyond each distance are updated with the given period.
+DISTANT_LOD_BANDS = ((2000, 0.1), (4000, 0.25))
+
+
+def body_position(entity):
+    """ Get the position of an entity's body, or None if it hasn't got one. """
+    body = entity.get_component(Body)
+    if body is None:
+        return None
+    return body.position
 
 
 def towards(e1, e2):
@@ -51,20 +63,6 @@ def towards(e1, e2):
     return b2.position - b1.position
 
 
-def get_team(e):
-    """ Get the team of an entity.  If the entity does not have a team then
-    this returns None. """
-    assert e is not None
-    ret = None
-    ct = e.get_component(Team)
-    if ct is not None:
-        if ct.parent.entity is not None:
-            ret = get_team(ct.parent.entity)
-        if ret is None:
-            ret = ct.team
-    return ret
-
-
 def setup_team(e1, e2):
     """ Put one entity under the team leadership of another. """
     t1 = e1.get_component(Team)
@@ -72,6 +70,11 @@ def setup_team(e1, e2):
     if t1 is not None and t2 is not None:
         t2.parent.entity = e1
 
+        # The team determines what the entity can collide with.
+        physics = e2.ecs().get_system(Physics)
+        if physics is not None:
+            physics.update_team(e2)
+
 
 def on_same_team(e1, e2):
     """ Are two entities friendly towards one another? """
@@ -94,30 +97,6 @@ def consume_power(e, amount):
         p.overloaded = True
         return 0
 
-def handle_damage_collision(dmg, hp):
-    """ Used to implement the 'damage on contact' behaviour. 
-    
-    'dmg' is a DamageOnContact component
-    
-    'hp' is a Hitpoints component.
-    """
-
-    # If our entity is about to die we might be about to spawn an
-    # explosion. If that's the case it should be travelling at the same
-    # speed as the thing we hit. So match velocities before our entity is
-    # killed.
-    if dmg.config.get_or_default("destroy_on_hit", True):
-        b1 = dmg.entity.get_component(Body)
-        b2 = hp.entity.get_component(Body)
-        if b1 is not None and b2 is not None:
-            b1.velocity = b2.velocity
-        do_explosion(dmg.entity)
-        dmg.entity.kill()
-
-    # Apply the damage.
-    apply_damage_to_entity(dmg.config["damage"], hp.entity)
-
-
 def do_explosion(entity):
     """ If an entity explodes, create the explosion. """
     explodes = entity.get_component(ExplodesOnDeath)
@@ -125,9 +104,20 @@ def do_explosion(entity):
     if explodes is not None and body is not None:
 
         # Create the explosion.
-        explosion = entity.ecs().create_entity(
-            explodes.config["explosion_config"])
-        teleport(explosion, body.position, body.velocity)
+        explosion_config = explodes.config["explosion_config"]
+        entity.ecs().get_system(ParticleSystem).emit(
+            explosion_config,
+            body.position,
+            body.velocity
+        )
+
+        # Damage what's caught in the blast, if the explosion has one.
+        blast = entity.game_services.get_resource_loader().load_config_file(
+            explosion_config
+        ).get_or_none("blast")
+        damage_system = entity.ecs().get_system(DamageSystem)
+        if blast is not None and damage_system is not None:
+            damage_system.queue_blast(body.position, blast, get_team(entity))
 
         # Shake the camera.
         cs = entity.ecs().get_system(CameraSystem)
@@ -162,19 +152,23 @@ def apply_damage_to_entity(damage, entity):
 
 
 def get_attached_entities(start_entity):
-    """ Get the entities attached to the one given. """
-    joints_entities = start_entity.ecs().query_include_queued(Joint)
+    """ Get the entities attached to the one given, either by joints or by
+    attachments. """
+    ecs = start_entity.ecs()
+    links = []
+    for joint_entity in ecs.query_include_queued(Joint):
+        joint = joint_entity.get_component(Joint)
+        links.append((joint.entity_a.entity, joint.entity_b.entity))
+    for attached_entity in ecs.query_include_queued(Attachment):
+        attachment = attached_entity.get_component(Attachment)
+        links.append((attachment.parent.entity, attached_entity))
     got = set()
     got.add(start_entity)
     while True:
         new = set()
-        for joint_entity in joints_entities:
-            joint = joint_entity.get_component(Joint)
-            if joint.entity_a.entity is None or \
-                            joint.entity_b.entity is None:
+        for (e1, e2) in links:
+            if e1 is None or e2 is None:
                 continue
-            e1 = joint.entity_a.entity
-            e2 = joint.entity_b.entity
             if e1 in got and not e2 in got:
                 new.add(e2)
             if e2 in got and not e1 in got:
@@ -242,8 +236,20 @@ def hit_scan(
                             distance, radius, aug_filter)
 
 
+def normalized_rows(vectors):
+    """ Normalise each row of an array of vectors, leaving zero rows as they
+    are, like Vec2d.normalized(). Returns the unit vectors and the lengths. """
+    lengths = numpy.sqrt((vectors ** 2).sum(axis=1))
+    safe = numpy.where(lengths > 0, lengths, 1)
+    return (vectors / safe[:, numpy.newaxis], lengths)
+
+
 class FollowsTrackedSystem(ComponentSystem):
-    """ Updates entities that follow other entities around. """
+    """ Updates entities that follow other entities around. The steering for
+    all of the followers is worked out at once. Followers can also flock:
+    they steer away from ('separation') and towards ('cohesion') others
+    following the same entity within 'flock_distance', so that swarms don't
+    stack up on top of each other. """
 
     def __init__(self):
         """ Constructor. """
@@ -252,6 +258,8 @@ class FollowsTrackedSystem(ComponentSystem):
     def update(self, dt):
         """ Update the followers. """
 
+        # Gather the followers that are tracking something.
+        followers = []
         for entity in self.entities():
 
             # If it's not tracking anything then don't do anything.
@@ -270,31 +278,214 @@ class FollowsTrackedSystem(ComponentSystem):
             if follows.follow_type == "instant":
                 this_body.position = that_body.position
                 continue
+            followers.append((entity, tracked_entity, this_body, that_body,
+                              follows.config))
+        if len(followers) == 0:
+            return
 
-            displacement = that_body.position - this_body.position
-            rvel = that_body.velocity - this_body.velocity
-            target_dist = follows.config["desired_distance_to_player"]
-
-            # distality is a mapping of distance onto the interval [0,1) to
-            # interpolate between two components
-            distality = 1 - 2 ** ( - displacement.length / target_dist )
-            direction = ( 1 - distality ) * rvel.normalized() + distality * displacement.normalized()
-
-            # Determine the fraction of our thrust to apply. This is governed by
-            # how far away the target is, and how far away we want to be.
-            frac = min(max(displacement.length / target_dist, rvel.length/200), 1)
-
-
-            # Apply force in the interpolated direction.
-            thrust = this_body.mass * follows.config["acceleration"]
-            force = frac * thrust * direction
-            physics = self.game_services.get_entity_manager().get_system(Physics)
+        # Gather the state of the followers and what they're following.
+        count = len(followers)
+        state = numpy.empty((count, 11))
+        for (i, (entity, tracked, this_body, that_body, cfg)) in enumerate(followers):
+            state[i] = (this_body.position[0], this_body.position[1],
+                        this_body.velocity[0], this_body.velocity[1],
+                        that_body.position[0], that_body.position[1],
+                        that_body.velocity[0], that_body.velocity[1],
+                        this_body.mass,
+                        cfg["acceleration"],
+                        cfg["desired_distance_to_player"])
+        positions = state[:, 0:2]
+        displacements = state[:, 4:6] - positions
+        rvels = state[:, 6:8] - state[:, 2:4]
+        masses = state[:, 8]
+        thrusts = masses * state[:, 9]
+        target_dists = state[:, 10]
+
+        # distality is a mapping of distance onto the interval [0,1) to
+        # interpolate between two components
+        (displacement_dirs, displacement_lengths) = normalized_rows(displacements)
+        (rvel_dirs, rvel_lengths) = normalized_rows(rvels)
+        distality = 1 - 2 ** (-displacement_lengths / target_dists)
+        directions = (1 - distality)[:, numpy.newaxis] * rvel_dirs + \
+            distality[:, numpy.newaxis] * displacement_dirs
+
+        # Determine the fraction of our thrust to apply. This is governed by
+        # how far away the target is, and how far away we want to be.
+        fracs = numpy.minimum(numpy.maximum(displacement_lengths / target_dists,
+                                            rvel_lengths / 200), 1)
+
+        # Apply force in the interpolated direction, plus any flocking.
+        forces = (fracs * thrusts)[:, numpy.newaxis] * directions
+        self.__add_flocking_forces(followers, positions, masses, forces)
+        physics = self.game_services.get_entity_manager().get_system(Physics)
+        for (i, follower) in enumerate(followers):
             physics.apply_force_at_local_point(
-                entity,
-                force,
+                follower[0],
+                Vec2d(float(forces[i, 0]), float(forces[i, 1])),
                 Vec2d(0, 0)
             )
 
+    def __add_flocking_forces(self, followers, positions, masses, forces):
+        """ Add the separation and cohesion forces of the followers that
+        flock. """
+        flocking = []
+        for (i, follower) in enumerate(followers):
+            cfg = follower[4]
+            separation = cfg.get_or_default("separation", 0)
+            cohesion = cfg.get_or_default("cohesion", 0)
+            if separation != 0 or cohesion != 0:
+                flocking.append((i, follower[1], separation, cohesion,
+                                 cfg.get_or_default("flock_distance", 100)))
+        if len(flocking) < 2:
+            return
+        indices = numpy.array([f[0] for f in flocking])
+        groups = {}
+        group_ids = numpy.array([groups.setdefault(f[1], len(groups))
+                                 for f in flocking])
+        separations = numpy.array([f[2] for f in flocking], dtype=float)
+        cohesions = numpy.array([f[3] for f in flocking], dtype=float)
+        flock_dists = numpy.array([f[4] for f in flocking], dtype=float)
+
+        # Find each follower's neighbours: others following the same entity
+        # within the flocking distance.
+        points = positions[indices]
+        offsets = points[:, numpy.newaxis, :] - points[numpy.newaxis, :, :]
+        dists = numpy.sqrt((offsets ** 2).sum(axis=2))
+        neighbours = (dists > 0) & (dists < flock_dists[:, numpy.newaxis]) & \
+            (group_ids[:, numpy.newaxis] == group_ids[numpy.newaxis, :])
+
+        # Separation pushes away from neighbours, harder the closer they are.
+        weights = numpy.where(
+            neighbours,
+            (1 - dists / flock_dists[:, numpy.newaxis]) / numpy.where(dists > 0, dists, 1),
+            0
+        )
+        away = (weights[:, :, numpy.newaxis] * offsets).sum(axis=1)
+
+        # Cohesion pulls towards the centre of the neighbours.
+        counts = neighbours.sum(axis=1)
+        centres = neighbours.dot(points) / numpy.maximum(counts, 1)[:, numpy.newaxis]
+        (towards, lengths) = normalized_rows(
+            numpy.where(counts[:, numpy.newaxis] > 0, centres - points, 0)
+        )
+        accelerations = separations[:, numpy.newaxis] * away + \
+            cohesions[:, numpy.newaxis] * towards
+        forces[indices] += masses[indices, numpy.newaxis] * accelerations
+
+
+class BudgetSystem(ComponentSystem):
+    """ Caps how many short lived things, like bullets and explosions, can
+    exist at once, so that frame times stay bounded in big fights. Each
+    category has an overall cap and optionally a cap per team, e.g.
+
+        budgets:
+          projectiles:
+            cap: 600
+            team_cap: 400
+
+    Categories without caps are unlimited. When an entity category is full,
+    the oldest entity in it is recycled to make room for the new one.
+    Particles are budgeted by the ParticleSystem, which merges or recycles
+    them. What was recycled, merged or dropped is counted, for telemetry.
+    Entities stop counting against a budget as soon as they're killed, and
+    are forgotten when their Body goes, so budgeted entities need a Body. """
+
+    def __init__(self, config=None):
+        """ Constructor. """
+        ComponentSystem.__init__(self, [Body])
+        if config is None:
+            config = Config()
+        self.__config = config
+        self.__live = {}
+        self.__team_counts = {}
+        self.__counts = collections.OrderedDict()
+
+    def cap(self, category):
+        """ Get the overall cap of a category, or None if it's unlimited. """
+        return self.get(category, "cap", None)
+
+    def get(self, category, key, default):
+        """ Get a setting for a category. """
+        category_config = self.__config.get_or_none(category)
+        if category_config is None:
+            return default
+        return category_config.get_or_default(key, default)
+
+    def make_room(self, category, team):
+        """ Make room for a new entity in a category on a team, recycling the
+        oldest entity if there's a cap that is reached. Call add() with the
+        new entity once it's been created. """
+        cap = self.cap(category)
+        team_cap = self.get(category, "team_cap", None)
+        if category not in self.__live:
+            return
+        live = self.__live[category]
+        team_counts = self.__team_counts[category]
+        if team_cap is not None and team_counts.get(team, 0) >= team_cap:
+            self.__forget_garbage(category)
+            if team_counts.get(team, 0) >= team_cap:
+                oldest = next(e for (e, t) in live.items() if t == team)
+                self.__recycle(category, oldest)
+        if cap is not None and len(live) >= cap:
+            self.__forget_garbage(category)
+            if len(live) >= cap:
+                self.__recycle(category, next(iter(live)))
+
+    def add(self, category, team, entity):
+        """ Add a new entity to a category. Only capped categories need to
+        keep track of their entities. """
+        if self.cap(category) is None and \
+           self.get(category, "team_cap", None) is None:
+            return
+        live = self.__live.setdefault(category, collections.OrderedDict())
+        team_counts = self.__team_counts.setdefault(category, {})
+        live[entity] = team
+        team_counts[team] = team_counts.get(team, 0) + 1
+
+    def on_component_remove(self, component):
+        """ Stop tracking an entity when it goes away, so that the live
+        counts are right and dead entities aren't recycled. """
+        entity = component.entity
+        for (category, live) in self.__live.items():
+            if entity in live:
+                self.__forget(category, entity)
+
+    def count(self, category, what):
+        """ Count something that happened to keep a category in budget:
+        'recycled', 'merged' or 'dropped'. """
+        counts = self.__counts.setdefault(
+            category, {"recycled": 0, "merged": 0, "dropped": 0})
+        counts[what] += 1
+
+    def stats(self):
+        """ Get the counts for each category, as a dictionary of
+        dictionaries with the numbers 'live' (for entity categories),
+        'recycled', 'merged' and 'dropped'. """
+        ret = collections.OrderedDict()
+        for category in self.__live:
+            self.__forget_garbage(category)
+        for category in sorted(set(self.__live) | set(self.__counts)):
+            ret[category] = {"live": len(self.__live.get(category, ())),
+                             "recycled": 0, "merged": 0, "dropped": 0}
+            ret[category].update(self.__counts.get(category, {}))
+        return ret
+
+    def __recycle(self, category, entity):
+        """ Kill an entity to make room for another. """
+        entity.kill()
+        self.__forget(category, entity)
+        self.count(category, "recycled")
+
+    def __forget(self, category, entity):
+        """ Stop tracking an entity. """
+        team = self.__live[category].pop(entity)
+        self.__team_counts[category][team] -= 1
+
+    def __forget_garbage(self, category):
+        """ Stop tracking entities that have died. """
+        for entity in [e for e in self.__live[category] if e.is_garbage]:
+            self.__forget(category, entity)
+
 
 class WeaponSystem(ComponentSystem):
     """ Updates entities that shoot bullets. """
@@ -363,7 +554,7 @@ class WeaponSystem(ComponentSystem):
             # Work out the muzzle velocity.
             muzzle_velocity = shooting_at_dir * weapon.config["bullet_speed"]
             spread = weapon.config["spread"]
-            muzzle_velocity.rotate_degrees(random.random() * spread - spread)
+            muzzle_velocity.rotate_degrees(self.random.random() * spread - spread)
             bullet_velocity = body.velocity+muzzle_velocity
 
             # Play a sound.
@@ -372,7 +563,12 @@ class WeaponSystem(ComponentSystem):
                 cs = self.game_services.get_entity_manager().get_system(CameraSystem)
                 cs.play_sound(shot_sound, body.position)
 
-            # Create the bullet.
+            # Create the bullet, keeping within the budget for its kind.
+            category = weapon.config.get_or_default("budget", "projectiles")
+            team = get_team(weapon.owner.entity)
+            budgets = self.game_services.get_entity_manager().get_system(BudgetSystem)
+            if budgets is not None:
+                budgets.make_room(category, team)
             bullet_entity = weapon.entity.ecs().create_entity(weapon.config["bullet_config"])
 
             # Set the position.
@@ -381,29 +577,439 @@ class WeaponSystem(ComponentSystem):
 
             # Set the team.
             setup_team(weapon.owner.entity, bullet_entity)
+            if budgets is not None:
+                budgets.add(category, team, bullet_entity)
+
+
+class DamageSystem(ComponentSystem):
+    """ Applies the damage done by things that damage on contact. Collisions
+    just queue damage events, which are applied together after the physics
+    step, so that nothing is killed or spawned in the middle of it.
+
+    The damage to each target is added up and applied once, so something hit
+    by several bullets in a step loses its shields and hitpoints, and
+    explodes, once. Things that are destroyed on hit only do damage once.
+
+    Explosions can also have a blast, which damages everything with
+    Hitpoints within its 'radius' that isn't on the exploding entity's team:
+
+        blast:
+          radius: 120
+          damage: 10
+          falloff: 1
+
+    The damage falls off as (1 - distance / radius) ** falloff, measured to
+    the edge of the body. The blasts queued in an update, including those of
+    things destroyed by contact damage in it, are applied together. Blasts
+    whose boxes overlap share one bounding box query of the physics world,
+    but blasts far apart are queried separately, so they don't search
+    everything between them. Things they destroy blast on the next update,
+    so chain reactions spread over frames. """
+
+    def __init__(self):
+        """ Constructor. """
+        ComponentSystem.__init__(self, [DamageOnContact])
+        self.__events = []
+        self.__blasts = []
+
+    def queue_damage(self, dmg, hp):
+        """ Queue the damage of a DamageOnContact component to the entity of
+        a Hitpoints component. """
+        self.__events.append((dmg.entity, hp.entity))
+
+    def queue_blast(self, position, blast_config, team):
+        """ Queue a blast at a position. It won't damage the given team. """
+        self.__blasts.append((tuple(position),
+                              blast_config["radius"],
+                              blast_config["damage"],
+                              blast_config.get_or_default("falloff", 1),
+                              team))
+
+    def update(self, dt):
+        """ Apply the queued damage. """
+        events = self.__events
+        self.__events = []
+
+        # Work out what each target takes, and what has been destroyed.
+        destroyed = collections.OrderedDict()
+        totals = collections.OrderedDict()
+        for (source, target) in events:
+            dmg = source.get_component(DamageOnContact)
+            if dmg is None or source in destroyed:
+                continue
+            if dmg.config.get_or_default("destroy_on_hit", True):
+                destroyed[source] = target
+            totals[target] = totals.get(target, 0) + dmg.config["damage"]
+
+        # If something is about to die it might spawn an explosion. If so, it
+        # should be travelling at the same speed as the thing it hit. So
+        # match velocities before killing it.
+        for (source, target) in destroyed.items():
+            b1 = source.get_component(Body)
+            b2 = target.get_component(Body)
+            if b1 is not None and b2 is not None:
+                b1.velocity = b2.velocity
+            do_explosion(source)
+            source.kill()
+
+        # Apply the damage.
+        for (target, damage) in totals.items():
+            apply_damage_to_entity(damage, target)
+
+        # Apply the damage done by blasts.
+        blasts = self.__blasts
+        self.__blasts = []
+        if len(blasts) > 0:
+            self.__apply_blasts(blasts)
+
+    def __apply_blasts(self, blasts):
+        """ Apply the damage of some blasts, all at once. """
+        positions = numpy.array([b[0] for b in blasts], dtype=float)
+        radii = numpy.array([b[1] for b in blasts], dtype=float)
+        damages = numpy.array([b[2] for b in blasts], dtype=float)
+        falloffs = numpy.array([b[3] for b in blasts], dtype=float)
+
+        # Find what's in the box around each cluster of overlapping blasts.
+        # Targets hit by several blasts are merged, so their damage can be
+        # added up.
+        physics = self.game_services.get_entity_manager().get_system(Physics)
+        targets = collections.OrderedDict()
+        pair_targets = []
+        pair_blasts = []
+        for (lower, upper, members) in self.__cluster_blasts(blasts):
+            for e in physics.get_entities_in_box(lower, upper):
+                if e.is_garbage or not e.has_component(Hitpoints):
+                    continue
+                team = get_team(e)
+                for i in members:
+                    if blasts[i][4] is not None and blasts[i][4] == team:
+                        continue
+                    pair_targets.append(targets.setdefault(e, len(targets)))
+                    pair_blasts.append(i)
+        if len(pair_targets) == 0:
+            return
+
+        # Work out the damage each blast does to each target in its cluster.
+        bodies = [e.get_component(Body) for e in targets]
+        target_positions = numpy.array([tuple(b.position) for b in bodies],
+                                       dtype=float)
+        sizes = numpy.array([b.size for b in bodies], dtype=float)
+        pair_targets = numpy.array(pair_targets)
+        pair_blasts = numpy.array(pair_blasts)
+        offsets = target_positions[pair_targets] - positions[pair_blasts]
+        distances = numpy.maximum(
+            numpy.sqrt((offsets ** 2).sum(axis=1)) - sizes[pair_targets], 0
+        )
+        fractions = numpy.maximum(1 - distances / radii[pair_blasts], 0) \
+            ** falloffs[pair_blasts]
+        totals = numpy.bincount(pair_targets,
+                                weights=fractions * damages[pair_blasts],
+                                minlength=len(targets))
+        for (target, total) in zip(targets, totals):
+            if total > 0:
+                apply_damage_to_entity(float(total), target)
+
+
+    @staticmethod
+    def __cluster_blasts(blasts):
+        """ Group blasts whose boxes overlap. Returns a list of the lower
+        left and upper right corners of each group's box, and the indices of
+        the blasts in it, in the order of their first blast. """
+        clusters = []
+        for (i, (position, radius, damage, falloff, team)) in \
+                enumerate(blasts):
+            lower = (position[0] - radius, position[1] - radius)
+            upper = (position[0] + radius, position[1] + radius)
+            members = [i]
+            merged = True
+            while merged:
+                merged = False
+                for cluster in clusters:
+                    (other_lower, other_upper, other_members) = cluster
+                    if lower[0] <= other_upper[0] and \
+                       other_lower[0] <= upper[0] and \
+                       lower[1] <= other_upper[1] and \
+                       other_lower[1] <= upper[1]:
+                        clusters.remove(cluster)
+                        lower = (min(lower[0], other_lower[0]),
+                                 min(lower[1], other_lower[1]))
+                        upper = (max(upper[0], other_upper[0]),
+                                 max(upper[1], other_upper[1]))
+                        members = sorted(members + other_members)
+                        merged = True
+                        break
+            clusters.append((lower, upper, members))
+        clusters.sort(key=lambda cluster: cluster[2][0])
+        return clusters
+
+
+class ProjectileSystem(ComponentSystem):
+    """ Moves projectiles. Projectiles aren't simulated by the Physics
+    system; their positions and velocities are stored as rows in arrays and
+    advanced in one go, and each projectile's path over the step is swept
+    through the physics world to find what it hits. Sweeping means fast
+    projectiles can't pass through things between frames.
+
+    The arrays are initialised from the Body when the projectile is added,
+    and positions are copied back to the Body after each update. Changes
+    made to the Body after that are not picked up. """
+
+    def __init__(self):
+        """ Constructor. """
+        ComponentSystem.__init__(self, [Projectile, Body])
+
+        # Entities waiting to be added.
+        self.__pending = collections.OrderedDict()
+
+        # Per-row data. Row i of the arrays belongs to self.__entities[i].
+        self.__entities = []
+        self.__bodies = []
+        self.__collision_filters = []
+        self.__rows = {}
+        self.__positions = numpy.zeros((0, 2))
+        self.__velocities = numpy.zeros((0, 2))
+        self.__radii = numpy.zeros(0)
+
+    def on_component_add(self, component):
+        """ Queue the projectile to be added. """
+        if component.__class__ == Projectile:
+            self.__pending[component.entity] = True
+
+    def on_component_remove(self, component):
+        """ Remove the projectile. """
+        entity = component.entity
+        self.__pending.pop(entity, None)
+        if entity in self.__rows:
+            self.__remove_row(entity)
+
+    def on_load(self):
+        """ Rebuild the arrays from the loaded components. """
+        for entity in list(self.__entities):
+            self.__remove_row(entity)
+        self.__pending = collections.OrderedDict(
+            (e, True) for e in self.entities()
+        )
+
+    def update(self, dt):
+        """ Advance the projectiles and apply any hits. """
+        self.__add_pending()
+        count = len(self.__entities)
+        if count == 0:
+            return
+
+        # Advance everything.
+        starts = self.__positions[:count].copy()
+        self.__positions[:count] += self.__velocities[:count] * dt
+        ends = self.__positions[:count]
+
+        # Look for hits along each path. The first body that a collision
+        # handler deals with stops the search.
+        physics = self.game_services.get_entity_manager().get_system(Physics)
+        for i in range(count):
+            entity = self.__entities[i]
+            if entity.is_garbage:
+                continue
+            hits = physics.sweep(
+                Vec2d(starts[i][0], starts[i][1]),
+                Vec2d(ends[i][0], ends[i][1]),
+                self.__radii[i],
+                self.__collision_filters[i]
+            )
+            for (hit_entity, hit_point, hit_normal) in hits:
+                self.__bodies[i].position = Vec2d(hit_point)
+                if physics.handle_collision(entity, hit_entity) is not None:
+
+                    # Stop at the hit, so that an explosion appears there.
+                    ends[i] = (hit_point[0], hit_point[1])
+                    break
+
+        # Copy the positions back to the bodies.
+        for i in range(count):
+            self.__bodies[i].position = Vec2d(ends[i][0], ends[i][1])
+
+    def __add_pending(self):
+        """ Give each pending projectile a row. """
+        physics = self.game_services.get_entity_manager().get_system(Physics)
+        for entity in self.__pending:
+            body = entity.get_component(Body)
+            if entity.is_garbage or body is None or entity in self.__rows:
+                continue
+            row = len(self.__entities)
+            if row == len(self.__radii):
+                self.__grow(max(16, row * 2))
+            self.__rows[entity] = row
+            self.__entities.append(entity)
+            self.__bodies.append(body)
+            self.__collision_filters.append(physics.collision_filter(entity))
+            self.__positions[row] = (body.position.x, body.position.y)
+            self.__velocities[row] = (body.velocity.x, body.velocity.y)
+            self.__radii[row] = body.size
+        self.__pending.clear()
+
+    def __grow(self, capacity):
+        """ Reallocate the arrays with a larger capacity. """
+        count = len(self.__entities)
+        positions = numpy.zeros((capacity, 2))
+        positions[:count] = self.__positions[:count]
+        self.__positions = positions
+        velocities = numpy.zeros((capacity, 2))
+        velocities[:count] = self.__velocities[:count]
+        self.__velocities = velocities
+        radii = numpy.zeros(capacity)
+        radii[:count] = self.__radii[:count]
+        self.__radii = radii
+
+    def __remove_row(self, entity):
+        """ Remove an entity's row by moving the last row into its place. """
+        row = self.__rows.pop(entity)
+        last = len(self.__entities) - 1
+        if row != last:
+            moved = self.__entities[last]
+            self.__rows[moved] = row
+            self.__entities[row] = moved
+            self.__bodies[row] = self.__bodies[last]
+            self.__collision_filters[row] = self.__collision_filters[last]
+            self.__positions[row] = self.__positions[last]
+            self.__velocities[row] = self.__velocities[last]
+            self.__radii[row] = self.__radii[last]
+        self.__entities.pop()
+        self.__bodies.pop()
+        self.__collision_filters.pop()
+
+
+class EffectSystem(ComponentSystem):
+    """ Moves effects. Effects aren't simulated by the Physics system, so
+    their bodies are integrated here instead: the positions and velocities
+    are gathered into an array, advanced in one go, and written back. The
+    Body remains the authority, so teleporting and other writes to it work
+    as usual. Impulses change the velocity but not the spin. """
+
+    def __init__(self):
+        """ Constructor. """
+        ComponentSystem.__init__(self, [Effect, Body])
+
+    def update(self, dt):
+        """ Advance the effects. """
+        bodies = [e.get_component(Body) for e in self.entities()]
+        if len(bodies) == 0:
+            return
+
+        # Gather the state, applying any impulses to the velocities.
+        state = numpy.zeros((len(bodies), 6))
+        for (i, body) in enumerate(bodies):
+            velocity = body.velocity
+            for (force, local_point) in body.impulses:
+                world_force = Vec2d(force).rotated_degrees(body.orientation)
+                velocity = velocity + world_force * (dt / body.mass)
+            body.impulses = []
+            state[i] = (body.position.x, body.position.y,
+                        velocity.x, velocity.y,
+                        body.orientation, body.angular_velocity)
+
+        # Advance everything.
+        state[:, 0:2] += state[:, 2:4] * dt
+        state[:, 4] += state[:, 5] * dt
+
+        # Write the new state back.
+        for (i, body) in enumerate(bodies):
+            body.position = Vec2d(state[i][0], state[i][1])
+            body.velocity = Vec2d(state[i][2], state[i][3])
+            body.orientation = state[i][4]
+
+
+def target_bodies(ecs):
+    """ Get the bodies that are worth chasing or shooting at: those on a
+    team, other than projectiles and effects. """
+    excluded = set(ecs.query(Projectile)) | set(ecs.query(Effect))
+    return [e.get_component(Body) for e in ecs.query(Team, Body)
+            if not e in excluded]
+
+
+class HostileIndex(object):
+    """ An index of bodies by team, for finding the nearest hostile bodies to
+    many points at once. Bodies without a team are never hostile. It should
+    be built from target_bodies(), so that it isn't filled with bullets. """
+
+    def __init__(self, bodies):
+        """ Index the given bodies. """
+        self.__bodies = []
+        positions = []
+        team_ids = []
+        self.__team_ids = {}
+        for body in bodies:
+            team = get_team(body.entity)
+            if team is None:
+                continue
+            if not team in self.__team_ids:
+                self.__team_ids[team] = len(self.__team_ids)
+            self.__bodies.append(body)
+            positions.append(tuple(body.position))
+            team_ids.append(self.__team_ids[team])
+        self.__positions = numpy.array(positions, dtype=float).reshape(-1, 2)
+        self.__teams = numpy.array(team_ids, dtype=int)
+
+    def nearest(self, team, points, max_distances):
+        """ Get the nearest body hostile to 'team' for each point, or None
+        where there is nothing hostile within the corresponding maximum
+        distance. A maximum distance of None means there's no limit. """
+        found = [None] * len(points)
+        if team is None or len(points) == 0:
+            return found
+        hostile = self.__teams != self.__team_ids.get(team, -1)
+        candidates = numpy.flatnonzero(hostile)
+        if len(candidates) == 0:
+            return found
+        offsets = self.__positions[numpy.newaxis, candidates, :] - \
+            numpy.array(points, dtype=float)[:, numpy.newaxis, :]
+        distances_squared = (offsets ** 2).sum(axis=2)
+        closest = distances_squared.argmin(axis=1)
+        for (i, max_distance) in enumerate(max_distances):
+            d2 = distances_squared[i, closest[i]]
+            if max_distance is None or d2 <= max_distance ** 2:
+                found[i] = self.__bodies[candidates[closest[i]]]
+        return found
 
 
 class TrackingSystem(ComponentSystem):
-    """ Update entities that track other entities. """
+    """ Update entities that track other entities. Trackers without a target
+    look for the nearest hostile body, all at once, and those that don't
+    find one wait for their retry period before looking again. Trackers are
+    updated at 5Hz. """
 
     def __init__(self):
         """ Constructor. """
-        ComponentSystem.__init__(self, [Tracking, Body])
+        ComponentSystem.__init__(self, [Tracking, Body], update_period=0.2)
 
     def update(self, dt):
         """ Update the trackers. """
-        for entity in self.entities():
-            self_body = entity.get_component(Body)
+
+        # Find the trackers that are due to look for a target, by team.
+        searching = {}
+        for (entity, entity_dt) in self.due_entities(dt):
             tracking = entity.get_component(Tracking)
             if tracking.tracked.entity is None and tracking.track_type == "team":
-                def f(body):
-                    return not on_same_team(entity, body.entity)
-                closest = entity.ecs().get_system(Physics).closest_body_with(
-                    self_body.position,
-                    f
-                )
-                if closest is not None:
-                    tracking.tracked.entity = closest.entity
+                if tracking.retry_timer.tick(entity_dt):
+                    tracking.retry_timer.reset()
+                    team = get_team(entity)
+                    searching.setdefault(team, []).append(entity)
+        if len(searching) == 0:
+            return
+
+        # Look for targets for each team in one go.
+        index = HostileIndex(target_bodies(self.game_services.get_entity_manager()))
+        for (team, trackers) in searching.items():
+            found = index.nearest(
+                team,
+                [tuple(e.get_component(Body).position) for e in trackers],
+                [e.get_component(Tracking).range for e in trackers]
+            )
+            for (entity, body) in zip(trackers, found):
+                if body is not None:
+                    tracking = entity.get_component(Tracking)
+                    tracking.tracked.entity = body.entity
+
+                    # Look again straight away if the target is lost.
+                    tracking.retry_timer.advance_to_fraction(1)
 
 
 class LaunchesFightersSystem(ComponentSystem):
@@ -425,7 +1031,7 @@ class LaunchesFightersSystem(ComponentSystem):
                 for i in range(launcher.config["num_fighters"]):
                     direction = Vec2d(0, 1)
                     spread = launcher.config["takeoff_spread"]
-                    direction.rotate_degrees(spread*random.random()-spread/2.0)
+                    direction.rotate_degrees(spread*self.random.random()-spread/2.0)
 
                     # Launch!
                     child = entity.ecs().create_entity(launcher.config["fighter_config"])
@@ -436,6 +1042,112 @@ class LaunchesFightersSystem(ComponentSystem):
                              body.velocity + direction * launcher.config["takeoff_spread"])
 
 
+class SquadronSystem(ComponentSystem):
+    """ Collapses the fighters launched by a carrier into one squadron entity
+    while they're all far from every camera and every hostile body, so that
+    a distant group costs one entity rather than one per fighter. The
+    squadron is expanded back into fighters when anything comes within
+    range. Launchers opt in by naming a 'squadron_config'. """
+
+    def __init__(self, config=None):
+        """ Constructor. """
+        ComponentSystem.__init__(self, [Squadron])
+        if config is None:
+            config = Config()
+        self.collapse_distance = config.get_or_default("collapse_distance", 4000)
+        self.expand_distance = config.get_or_default("expand_distance", 3000)
+        self.check_timer = Timer(config.get_or_default("check_period", 0.5))
+
+    def update(self, dt):
+        """ Collapse and expand squadrons, if it's time to check. """
+        if not self.check_timer.tick(dt):
+            return
+        self.check_timer.reset()
+        ecs = self.game_services.get_entity_manager()
+        cameras = numpy.array(
+            [tuple(e.get_component(Body).position)
+             for e in ecs.query(Camera, Body)],
+            dtype=float
+        ).reshape(-1, 2)
+        index = HostileIndex(target_bodies(ecs))
+
+        # Expand the squadrons that something has come near.
+        for entity in self.entities():
+            position = entity.get_component(Body).position
+            if self.__near(index, cameras, get_team(entity), [position],
+                           self.expand_distance)[0]:
+                self.expand(entity)
+
+        # Collapse the groups of fighters that are far from everything.
+        for entity in ecs.query(LaunchesFighters):
+            launcher = entity.get_component(LaunchesFighters)
+            if launcher.config.get_or_none("squadron_config") is None:
+                continue
+            fighters = list(launcher.launched)
+            if len(fighters) < 2 or \
+               any(f.has_component(Squadron) or f.is_garbage for f in fighters):
+                continue
+            positions = [f.get_component(Body).position for f in fighters]
+            if not any(self.__near(index, cameras, get_team(fighters[0]),
+                                   positions, self.collapse_distance)):
+                self.collapse(entity, fighters)
+
+    def __near(self, index, cameras, team, positions, distance):
+        """ Get whether each position is within the distance of a camera or
+        of something hostile to the team. """
+        points = numpy.array([tuple(p) for p in positions], dtype=float)
+        near = numpy.zeros(len(points), dtype=bool)
+        if len(cameras) > 0:
+            offsets = points[:, numpy.newaxis, :] - cameras[numpy.newaxis, :, :]
+            near |= ((offsets ** 2).sum(axis=2) <= distance ** 2).any(axis=1)
+        hostiles = index.nearest(team, points, [distance] * len(points))
+        near |= numpy.array([h is not None for h in hostiles], dtype=bool)
+        return near
+
+    def collapse(self, launcher_entity, fighters):
+        """ Replace a carrier's fighters with a squadron. """
+        launcher = launcher_entity.get_component(LaunchesFighters)
+        bodies = [f.get_component(Body) for f in fighters]
+        centre = sum((b.position for b in bodies), Vec2d(0, 0)) / len(bodies)
+        velocity = sum((b.velocity for b in bodies), Vec2d(0, 0)) / len(bodies)
+        entity = launcher_entity.ecs().create_entity(
+            launcher.config["squadron_config"]
+        )
+        squadron = entity.get_component(Squadron)
+        squadron.fighter_config = launcher.config["fighter_config"]
+        squadron.launcher.entity = launcher_entity
+        for (fighter, body) in zip(fighters, bodies):
+            hitpoints = fighter.get_component(Hitpoints)
+            squadron.members.append((body.position - centre, hitpoints.hp))
+            fighter.kill()
+        hitpoints = entity.get_component(Hitpoints)
+        hitpoints.hp = sum(hp for (offset, hp) in squadron.members)
+        hitpoints.max_hp = hitpoints.hp
+        setup_team(launcher_entity, entity)
+        teleport(entity, centre, velocity)
+        launcher.launched.add_ref_to(entity)
+
+    def expand(self, entity):
+        """ Replace a squadron with its fighters. Damage done to the squadron
+        is shared out between them in proportion to their hitpoints. """
+        squadron = entity.get_component(Squadron)
+        body = entity.get_component(Body)
+        hitpoints = entity.get_component(Hitpoints)
+        remaining = float(hitpoints.hp) / hitpoints.max_hp
+        launcher_entity = squadron.launcher.entity
+        for (offset, hp) in squadron.members:
+            fighter = entity.ecs().create_entity(squadron.fighter_config)
+            fighter.get_component(Hitpoints).hp = hp * remaining
+            if launcher_entity is not None:
+                launcher = launcher_entity.get_component(LaunchesFighters)
+                launcher.launched.add_ref_to(fighter)
+                setup_team(launcher_entity, fighter)
+            else:
+                fighter.get_component(Team).team = get_team(entity)
+            teleport(fighter, body.position + offset, body.velocity)
+        entity.kill()
+
+
 class KillOnTimerSystem(ComponentSystem):
     """ Updates entities that die after a timer. """
 
@@ -452,45 +1164,46 @@ class KillOnTimerSystem(ComponentSystem):
 
 
 class PowerSystem(ComponentSystem):
-    """ Updates entities that store / produce power. """
+    """ Updates entities that store / produce power. Distant ones are updated
+    less often. """
 
     def __init__(self):
         """ Constructor. """
-        ComponentSystem.__init__(self, [Power])
+        ComponentSystem.__init__(self, [Power], lod_bands=DISTANT_LOD_BANDS)
 
     def update(self, dt):
         """ Update the entities."""
-        for e in self.entities():
+        for (e, entity_dt) in self.due_entities(dt):
             power = e.get_component(Power)
             if power.overloaded:
-                if power.overload_timer.tick(dt):
+                if power.overload_timer.tick(entity_dt):
                     power.overloaded = False
                     power.overload_timer.reset()
             else:
-                power.power = min(power.capacity, power.power + power.recharge_rate * dt)
+                power.power = min(power.capacity, power.power + power.recharge_rate * entity_dt)
 
 
 class ShieldSystem(ComponentSystem):
-    """ Updates entities with shields. """
+    """ Updates entities with shields. Distant ones are updated less often. """
 
     def __init__(self):
         """ Constructor. """
-        ComponentSystem.__init__(self, [Shields])
+        ComponentSystem.__init__(self, [Shields], lod_bands=DISTANT_LOD_BANDS)
 
     def update(self, dt):
         """ Update the shields. """
-        for e in self.entities():
+        for (e, entity_dt) in self.due_entities(dt):
             shields = e.get_component(Shields)
             power = e.get_component(Power)
             if power is None:
                 shields.hp = 0
             else:
                 if shields.overloaded:
-                    if shields.overload_timer.tick(dt):
+                    if shields.overload_timer.tick(entity_dt):
                         shields.overloaded = False
                         shields.overload_timer.reset()
                 else:
-                    recharge_amount = min(shields.max_hp - shields.hp, shields.recharge_rate * dt)
+                    recharge_amount = min(shields.max_hp - shields.hp, shields.recharge_rate * entity_dt)
                     shields.hp = min(shields.max_hp, shields.hp + consume_power(e, recharge_amount))
 
 
@@ -515,44 +1228,142 @@ class TextSystem(ComponentSystem):
 
 
 class AnimSystem(ComponentSystem):
-    """ Updates entities with animations. """
+    """ Updates entities with animations. Distant ones are updated less
+    often. """
 
     def __init__(self):
         """ Constructor. """
-        ComponentSystem.__init__(self, [AnimationComponent])
+        ComponentSystem.__init__(self, [AnimationComponent],
+                                 lod_bands=DISTANT_LOD_BANDS)
 
     def update(self, dt):
         """ Update the animations. """
-        for e in self.entities():
+        for (e, entity_dt) in self.due_entities(dt):
             c = e.get_component(AnimationComponent)
-            if c.anim.tick(dt):
+            if c.anim.tick(entity_dt):
                 if c.config.get_or_default("kill_on_finish", 0):
                     e.kill()
                 else:
                     c.anim.reset()
 
 
-class ThrusterSystem(ComponentSystem):
-    """ Updates entities that are thrusters. """
+class ParticleSystem(ComponentSystem):
+    """ Simulates short lived effects, like explosions, as particles rather
+    than entities. Each kind of particle is an emitter, which is defined by an
+    entity config with an AnimationComponent - e.g. the explosion configs -
+    and keeps its particles as rows in arrays that are advanced in one go.
+    A particle lives for one run through its animation. """
+
+    class Emitter(object):
+        """ Particles that share an animation. """
+
+        def __init__(self, animation, brightness=0.0, capacity=16):
+            """ Constructor. """
+            self.frames = animation.frames
+            self.period = animation.timer.period
+            self.brightness = brightness
+            self.count = 0
+            self.positions = numpy.zeros((capacity, 2))
+            self.velocities = numpy.zeros((capacity, 2))
+            self.ages = numpy.zeros(capacity)
+
+        def emit(self, position, velocity):
+            """ Add a particle. """
+            if self.count == len(self.ages):
+                capacity = 2 * len(self.ages)
+                for name in ("positions", "velocities", "ages"):
+                    old = getattr(self, name)
+                    new = numpy.zeros((capacity,) + old.shape[1:])
+                    new[:self.count] = old[:self.count]
+                    setattr(self, name, new)
+            self.positions[self.count] = tuple(position)
+            self.velocities[self.count] = tuple(velocity)
+            self.ages[self.count] = 0
+            self.count += 1
+
+        def merge(self, position, distance):
+            """ Is there a particle early in its life within a distance of a
+            position, that a new one could be merged into? """
+            n = self.count
+            offsets = self.positions[:n] - tuple(position)
+            near = (offsets ** 2).sum(axis=1) <= distance ** 2
+            young = self.ages[:n] < self.period / 4
+            return bool(numpy.any(near & young))
+
+        def recycle(self, position, velocity):
+            """ Restart the oldest particle as a new one. Returns whether
+            there was a particle to recycle. """
+            if self.count == 0:
+                return False
+            oldest = self.ages[:self.count].argmax()
+            self.positions[oldest] = tuple(position)
+            self.velocities[oldest] = tuple(velocity)
+            self.ages[oldest] = 0
+            return True
+
+        def update(self, dt):
+            """ Advance the particles, and remove those that have finished. """
+            n = self.count
+            self.positions[:n] += self.velocities[:n] * dt
+            self.ages[:n] += dt
+            alive = numpy.flatnonzero(self.ages[:n] < self.period)
+            if len(alive) < n:
+                self.count = len(alive)
+                self.positions[:self.count] = self.positions[alive]
+                self.velocities[:self.count] = self.velocities[alive]
+                self.ages[:self.count] = self.ages[alive]
+
+        def frame_indices(self):
+            """ Get the animation frame of each particle. This is the same
+            mapping of time to frames as Timer.pick_index(). """
+            last = len(self.frames) - 1
+            return numpy.minimum(
+                (self.ages[:self.count] / self.period * last).astype(int), last)
 
     def __init__(self):
         """ Constructor. """
-        ComponentSystem.__init__(self, [Thruster])
+        ComponentSystem.__init__(self, [])
+        self.__emitters = collections.OrderedDict()
+
+    def matches(self, component_type):
+        """ Particles aren't entities, so no components are ours. """
+        return False
+
+    def emit(self, config_name, position, velocity):
+        """ Emit a particle of the kind defined by an entity config. If the
+        'explosions' budget is used up, the particle is merged into a nearby
+        young one of the same kind, or replaces the oldest one, or failing
+        that is dropped. """
+        if not config_name in self.__emitters:
+            loader = self.game_services.get_resource_loader()
+            config = loader.load_config_file(config_name)
+            anim_config = config["components"]["src.components.AnimationComponent"]
+            self.__emitters[config_name] = ParticleSystem.Emitter(
+                loader.load_animation(anim_config["anim_name"]),
+                anim_config.get_or_default("brightness", 0.0)
+            )
+        emitter = self.__emitters[config_name]
+        budgets = self.game_services.get_entity_manager().get_system(BudgetSystem)
+        cap = None
+        if budgets is not None:
+            cap = budgets.cap("explosions")
+        if cap is None or sum(e.count for e in self.emitters()) < cap:
+            emitter.emit(position, velocity)
+        elif emitter.merge(position, budgets.get("explosions", "merge_distance", 30)):
+            budgets.count("explosions", "merged")
+        elif emitter.recycle(position, velocity):
+            budgets.count("explosions", "recycled")
+        else:
+            budgets.count("explosions", "dropped")
+
+    def emitters(self):
+        """ Get the emitters. """
+        return self.__emitters.values()
 
     def update(self, dt):
-        """ Update the thrusters. """
-        for entity in self.entities():
-            thruster = entity.get_component(Thruster)
-            attached = thruster.attached_to.entity
-            if attached is None:
-                entity.kill()
-            else:
-                physics = self.game_services.get_entity_manager().get_system(Physics)
-                physics.apply_force_at_local_point(
-                    attached,
-                    thruster.thrust * thruster.direction,
-                    thruster.position
-                )
+        """ Advance the particles. """
+        for emitter in self.__emitters.values():
+            emitter.update(dt)
 
 
 class ThrustersSystem(ComponentSystem):
@@ -562,18 +1373,6 @@ class ThrustersSystem(ComponentSystem):
         """ Constructor. """
         ComponentSystem.__init__(self, [Body, Thrusters])
 
-    def on_component_add(self, component):
-        """ When thrusters are added to an entity we need to create the actual
-        thrusters themselves, which are specified in the config. """
-        if component.__class__ == Thrusters:
-            thruster_cfgs = component.config.get_or_default("thrusters", [])
-            for cfg in thruster_cfgs:
-                thruster_ent = component.entity.ecs().create_entity()
-                thruster = Thruster(thruster_ent, self.game_services, cfg)
-                thruster.attached_to.entity = component.entity
-                thruster_ent.add_component(thruster)
-                component.thrusters.add_ref_to(thruster_ent)
-
     def update(self, dt):
         """ Update the entities. """
         for entity in self.entities():
@@ -592,136 +1391,64 @@ class ThrustersSystem(ComponentSystem):
 
             # Fire thrusters to achieve desired spin and direction.
             self.fire_correct_thrusters(thrusters, thrusters.direction, turn)
+            self.apply_thrust(entity, thrusters)
 
     def compute_correct_thrusters(self, thrusters, direction, turn):
         """ Perform logic to determine what engines are firing based on the
-        desired direction. Automatically counteract spin. We cope with an
-        arbitrary configuration of thrusters through use of a mathematical
-        optimisation algorithm (scipy.optimize.minimize.)
-
-        Variables: t0, t1, t2, ...
-        Function: g . f where
-                  f(t0, t1, t2, ...) -> (acceleration, moment)
-                  g(acceleration, moment) -> distance from desired (accel, moment)
-        Constraint: t0min <= t0 <= t0max, ...
-
-        Note: there may be a better way of solving this problem, I
-        don't know. I will try to state the problem clearly here so
-        that a better solution might present itself:
-
-        Note: notation a little odd in the following:
-
-        We have a set of N thrusters, (Tn, Dn, Pn, TMAXn), where "Tn" is
-        the thruster's current (scalar) thrust, Pn is its position,
-        and FMAXn is the maximum thrust it can exert. Dn is the direction
-        of thrust, so the force currently being exerted, Fn, is Tn*Dn.
-
-        The acceleration due to a given thruster:
-
-            An = m * Fn
-
-        where m is the mass of the body.
-
-        The centre of mass is the origin O.
-
-        The torque due to a given thruster is therefore
-
-            Qn = |Pn| * norm(orth(Pn)) * Fn.
-
-        The resultant force on the body, F', is F0+F1+...+Fn
-
-        The resultant torque on the body, Q', is Q0+Q1+...+Qn
-
-        The following constraints are in effect:
-
-            T0 >= 0, T1 >= 0, ..., Tn >= 0
-
-            T0 <= TMAX0, T1 <= TMAX1, Tn <= TMAXn
-
-        In my implementation here, the vector T0..n is the input array for a
-        function to be minimised.
-
-        Note that this function is very slow. Some sort of caching scheme will be
-        a must - and it would be good to share identical configurations between
-        entities.
-
-        I don't know whether there is an analytical solution to this problem.
-
-        """
-
-        def f(thrusts):
-            """ Objective function. Determine the resultant force and torque on
-            the body, and then apply heuristics (absolute guesswork!!) to determine
-            the fitness. We can then use a minimisation algorithm to optimise the
-            thruster configuration. """
-
-            # Calculate the resultant force and moment from applying all thrusters.
-            resultant_force = Vec2d(0, 0);
-            resultant_moment = 0
-            for i in range(0, len(thrusts)):
-                thruster = thrusters.thrusters[i].get_component(Thruster)
-                thrust = float(thrusts[i])
-                force = thruster.direction * thrust
-                resultant_force += force
-                resultant_moment += thruster.position.length * thruster.position.perpendicular_normal().dot(force)
-
-            # We want to maximise the force in the direction in which we want to
-            # be thrusting.
-            force_objective = direction.normalized().dot(resultant_force)
-
-            # We want to maximise the torque in the direction we want.
-            moment_objective = numpy.sign(turn) * resultant_moment
-
-            # We negate the values because we want to *minimise*
-            return -force_objective - moment_objective
-
-        # Initial array of values.
-        thrusts = numpy.zeros(len(thrusters.thrusters))
-
-        # Thrust bounds.
-        thrust_bounds = [(0, thruster.get_component(Thruster).max_thrust) for thruster in thrusters.thrusters]
-
-        # Optimise the thruster values.
-        return scipy.optimize.minimize(f, thrusts, method="TNC", bounds=thrust_bounds)
+        desired direction, without going through the cache. Returns an array
+        of the thrusts. """
+        return solve_thrusts(thrusters.layout, direction, turn)
 
     def fire_correct_thrusters(self, thrusters, direction, torque):
         """ Perform logic to determine what engines are firing based on the
         desired direction. Automatically counteract spin. """
 
         # If no thrusters to fire then don't bother!
-        if len(thrusters.thrusters) == 0:
+        if len(thrusters.layout) == 0:
             return
 
-        # By default the engines should be off.
-        for entity in thrusters.thrusters:
-            thruster = entity.get_component(Thruster)
-            thruster.thrust = 0
+        # Get the solution from the cache shared by all ships.
+        solutions = self.game_services.get_resource_loader().get_thrust_solutions()
+        thrusters.thrusts = solutions.get(thrusters.layout, direction, torque)
 
-        # Come up with a dictionary key.
-        key = (direction.x, direction.y, torque, len(thrusters.thrusters))
-
-        # Ensure a configuration exists for this input.
-        if not key in thrusters.thruster_configurations:
-            thrusters.thruster_configurations[key] = \
-                self.compute_correct_thrusters(thrusters, direction, torque)
-
-        # Get the cached configuration and set the thrust.
-        result = thrusters.thruster_configurations[key]
-        for i in range(0, len(result.x)):
-            thruster = thrusters.thrusters[i].get_component(Thruster)
-            thruster.thrust = float(result.x[i])
+    def apply_thrust(self, entity, thrusters):
+        """ Apply the net force and moment of the thrusters to the body. That
+        is a single force at a point chosen to give the moment, unless the
+        forces cancel out, when it takes a couple. """
+        if not numpy.any(thrusters.thrusts):
+            return
+        forces = thrusters.directions * thrusters.thrusts[:, numpy.newaxis]
+        (fx, fy) = (float(f) for f in forces.sum(axis=0))
+        moment = float(numpy.sum(thrusters.positions[:, 0] * forces[:, 1] -
+                                 thrusters.positions[:, 1] * forces[:, 0]))
+        physics = self.game_services.get_entity_manager().get_system(Physics)
+        magnitude_squared = fx*fx + fy*fy
+        if magnitude_squared > 0:
+            point = Vec2d(fy, -fx) * (moment / magnitude_squared)
+            physics.apply_force_at_local_point(entity, Vec2d(fx, fy), point)
+        elif moment != 0:
+            physics.apply_force_at_local_point(entity, Vec2d(moment, 0),
+                                               Vec2d(0, -1))
+            physics.apply_force_at_local_point(entity, Vec2d(-moment, 0),
+                                               Vec2d(0, 0))
 
 
 class WaveSpawnerSystem(ComponentSystem):
-    """ Spawns waves of enemies. """
+    """ Spawns waves of enemies. Building a ship and everything attached to
+    it is expensive, so while the message announcing a wave is up the
+    enemies are built a few per frame and kept dormant. They're all
+    activated at once when the wave starts. """
 
-    def __init__(self):
+    def __init__(self, prewarm_per_frame=1):
         ComponentSystem.__init__(self, [])
         self.wave = 1
         self.spawned = EntityRefList()
         self.message = None
         self.done = False
         self.endgame_timer = Timer(15)
+        self.prewarm_per_frame = prewarm_per_frame
+        self.__planned = []
+        self.__prewarmed = []
 
     def update(self, dt):
         """ Update the spawner. """
@@ -732,6 +1459,7 @@ class WaveSpawnerSystem(ComponentSystem):
                 self.game_services.end_game()
         elif self.player_is_dead() or self.max_waves():
             self.done = True
+            self.abandon_wave()
             txt = "GAME OVER"
             if self.max_waves():
                 txt = "VICTORY"
@@ -743,6 +1471,9 @@ class WaveSpawnerSystem(ComponentSystem):
         if self.wave_is_dead() and self.message is None:
             self.prepare_for_wave()
 
+        # Build some of the next wave while the message is up.
+        self.prewarm(self.prewarm_per_frame)
+
         # If we're prepared to spawn i.e. the wave is dead and the message has gone, spawn a wave!
         if self.prepared_to_spawn():
             self.spawn_wave()
@@ -752,25 +1483,64 @@ class WaveSpawnerSystem(ComponentSystem):
         players = self.game_services.get_entity_manager().query(Player)
         return len(players) == 0
 
+    def plan_wave(self):
+        """ Choose the enemies for the next wave, each one harder than the
+        last. """
+        self.__planned = []
+        for i in range(self.wave):
+            enemy_type = self.random.choice(("enemies/destroyer.txt",
+                                        "enemies/carrier.txt"))
+            rnd = self.random.random()
+            x = 1 - rnd*2
+            y = 1 - (1-rnd)*2
+            self.__planned.append((enemy_type, Vec2d(x, y)*500))
+
+    def prewarm(self, count):
+        """ Build up to 'count' of the planned enemies, as dormant
+        entities. """
+        ecs = self.game_services.get_entity_manager()
+        while count > 0 and len(self.__prewarmed) < len(self.__planned):
+            (enemy_type, offset) = self.__planned[len(self.__prewarmed)]
+            entity = ecs.create_dormant_entity(enemy_type)
+            entity.get_component(Team).team = "enemy"
+            self.__prewarmed.append(entity)
+            count -= 1
+
+    def abandon_wave(self):
+        """ Forget the planned wave, and free anything built for it. """
+        self.game_services.get_entity_manager().kill_dormant_entities()
+        self.__planned = []
+        self.__prewarmed = []
+
+    def on_load(self):
+        """ The entities built for the next wave belonged to the old game, so
+        start building it again. """
+        self.abandon_wave()
+        if self.message is not None:
+            self.plan_wave()
+
     def spawn_wave(self):
-        """ Spawn a wave of enemies, each one harder than the last."""
+        """ Spawn the planned wave of enemies around the player, activating
+        the entities built by prewarm()."""
         players = self.game_services.get_entity_manager().query(Player)
         if len(players) == 0:
             return
         player = players[0]
         player_body = player.get_component(Body)
         self.wave += 1
-        for i in range(self.wave-1):
-            enemy_type = random.choice(("enemies/destroyer.txt",
-                                        "enemies/carrier.txt"))
-            rnd = random.random()
-            x = 1 - rnd*2
-            y = 1 - (1-rnd)*2
-            enemy_position = player_body.position + Vec2d(x, y)*500
-            entity = self.game_services.get_entity_manager().create_entity(enemy_type)
-            entity.get_component(Team).team = "enemy"
-            teleport(entity, enemy_position)
+        self.prewarm(len(self.__planned))
+        self.game_services.get_entity_manager().activate_dormant_entities()
+        for (entity, (enemy_type, offset)) in zip(self.__prewarmed,
+                                                  self.__planned):
+            teleport(entity, player_body.position + offset)
             self.spawned.add_ref_to(entity)
+        self.__planned = []
+        self.__prewarmed = []
+
+        # The mix of bodies has changed, so the broadphase may want tuning.
+        physics = self.game_services.get_entity_manager().get_system(Physics)
+        if physics is not None:
+            physics.tune_broadphase()
 
     def wave_is_dead(self):
         """ Has the last wave been wiped out? """
@@ -780,6 +1550,7 @@ class WaveSpawnerSystem(ComponentSystem):
         """ Prepare for a wave. """
         self.message = self.game_services.get_entity_manager().create_entity("update_message.txt")
         self.message.get_component(Text).text = "WAVE %s PREPARING" % self.wave
+        self.plan_wave()
 
     def prepared_to_spawn(self):
         """ Check whether the wave is ready. """
@@ -822,15 +1593,19 @@ class CameraSystem(ComponentSystem):
             sound.play_positional(position - camera_position)
 
     def update(self, dt):
-        """ Update the cameras. """
+        """ Update the cameras, and measure level of detail from them. """
+        self.game_services.get_entity_manager().set_lod_origins(
+            [tuple(e.get_component(Body).position) for e in self.entities()],
+            body_position
+        )
         for camera_ent in self.entities():
             camera = camera_ent.get_component(Camera)
             if camera.shake > 0:
                 camera.shake -= dt * camera.damping_factor
             if camera.shake < 0:
                 camera.shake = 0
-            camera.vertical_shake = (1-2*random.random()) * camera.shake
-            camera.horizontal_shake = (1-2*random.random()) * camera.shake
+            camera.vertical_shake = (1-2*self.random.random()) * camera.shake
+            camera.horizontal_shake = (1-2*self.random.random()) * camera.shake
 
 
 class TurretSystem(ComponentSystem):
@@ -842,6 +1617,9 @@ class TurretSystem(ComponentSystem):
 
     def update(self, dt):
         """ Update the system. """
+
+        # Work out what each turret is shooting at.
+        turrets = []
         for entity in self.entities():
 
             # Kill detached turrets
@@ -874,7 +1652,19 @@ class TurretSystem(ComponentSystem):
                 if tracking is not None:
                     tracked = tracking.tracked.entity
                     if tracked is not None:
-                        shooting_at = DirectionProviderBody(entity, tracked)
+                        shooting_at = self.aim_at(entity, gun, tracked)
+            turrets.append((entity, turret, body, gun, shooting_at))
+
+        # Lead the targets of all of the turrets at once, including those of
+        # guns still firing a burst at an earlier target.
+        leads = collections.OrderedDict()
+        for (entity, turret, body, gun, shooting_at) in turrets:
+            for provider in (shooting_at, gun.shooting_at):
+                if isinstance(provider, DirectionProviderLead):
+                    leads[id(provider)] = provider
+        solve_leads(leads.values())
+
+        for (entity, turret, body, gun, shooting_at) in turrets:
             if shooting_at is not None:
                 body.orientation = 90 + shooting_at.direction().angle_degrees
             body.angular_velocity = 0
@@ -898,6 +1688,15 @@ class TurretSystem(ComponentSystem):
                     turret.burst_timer.reset()
                     gun.shooting_at = None
 
+    def aim_at(self, entity, gun, target):
+        """ Get a direction provider for a turret to shoot at a target. Beams
+        hit straight away, so point straight at it; bullets take time to get
+        there, so lead it. """
+        bullet_speed = gun.config.get_or_none("bullet_speed")
+        if gun.weapon_type == "beam" or bullet_speed is None:
+            return DirectionProviderBody(entity, target)
+        return DirectionProviderLead(entity, target, bullet_speed)
+
 
 class TurretsSystem(ComponentSystem):
     """ Manages entities that have a set of turrets attached to them. """
@@ -955,11 +1754,8 @@ class TurretsSystem(ComponentSystem):
             turret_body.position = local_to_world(body.entity, turret.position)
             turret_body.velocity = body.velocity
 
-            # Pin the bodies together.
-            joint_entity = component.entity.ecs().create_entity()
-            joint = Joint(joint_entity, self.game_services, Config())
-            joint.entity_a.entity = component.entity
-            joint.entity_a_local_point = turret.position
-            joint.entity_b.entity = turret_entity
-            joint.entity_b_local_point = Vec2d(0, 0)
-            joint_entity.add_component(joint)
+            # Attach the turret to the ship.
+            attachment = Attachment(turret_entity, self.game_services, Config())
+            attachment.parent.entity = component.entity
+            attachment.position = turret.position
+            turret_entity.add_component(attachment)
@@ -0,0 +1,41 @@
+import unittest
+from ..checksum import state_checksum
+from ..components import Body, Hitpoints
+from ..config import Config
+from ..utils import Vec2d
+from testing import *
+
+def create_seeded_entman(seed):
+    """ Create an entity manager with some bodies placed by its random
+    number stream. """
+    game_services = create_entman_testing_services()
+    entman = game_services.get_entity_manager()
+    entman.set_seed(seed)
+    stream = entman.random_stream("test")
+    bodies = []
+    for i in range(5):
+        entity = entman.create_entity(Config({"components": {
+            "src.physics.Body": {},
+            "src.components.Hitpoints": {"hp": 10}
+        }}))
+        body = entity.get_component(Body)
+        body.position = Vec2d(stream.uniform(-100, 100),
+                              stream.uniform(-100, 100))
+        body.velocity = Vec2d(stream.uniform(-10, 10), 0)
+        bodies.append(body)
+    entman.create_queued_objects()
+    return (entman, bodies)
+
+class ChecksumTest(unittest.TestCase):
+
+    def test_same_seed_same_checksum(self):
+        """ Identically seeded games should have the same checksum, and moving
+        one body should change it. """
+        (entman1, bodies1) = create_seeded_entman(7)
+        (entman2, bodies2) = create_seeded_entman(7)
+        self.assertEquals(state_checksum(entman1), state_checksum(entman2))
+        bodies2[3].position += Vec2d(0.5, 0)
+        self.assertNotEquals(state_checksum(entman1), state_checksum(entman2))
+
+if __name__ == '__main__':
+    unittest.main()
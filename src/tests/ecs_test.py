@@ -1,3 +1,5 @@
+import StringIO
+import pickle
 import unittest
 from ..ecs import *
 from testing import *
@@ -169,6 +171,98 @@ class EntityManagerTest(unittest.TestCase):
         entman.update(1)
         assert not entity in entman.objects
 
+    def test_random_streams(self):
+        """ Named random streams should be reproducible from the seed, and
+        independent of each other. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.set_seed(5)
+        a = entman.random_stream("a")
+        first = [a.random() for i in range(3)]
+        other = entman.random_stream("b").random()
+        entman.set_seed(5)
+        self.assertEquals([a.random() for i in range(3)], first)
+        assert other not in first
+
+    def test_lod_distances(self):
+        """ Level of detail distances should be worked out once per frame,
+        however many times they're asked for. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entity = entman.create_entity()
+        unplaced = entman.create_entity()
+        entman.create_queued_objects()
+        positions = {entity: (300, 400)}
+        looked_up = []
+        def position_of(e):
+            looked_up.append(e)
+            return positions.get(e)
+        entman.set_lod_origins([(0, 0), (1000, 0)], position_of)
+        self.assertEquals(list(entman.lod_distances([entity, unplaced])),
+                          [500, 0])
+        self.assertEquals(list(entman.lod_distances([entity])), [500])
+        self.assertEquals(looked_up, [entity, unplaced])
+        positions[entity] = (900, 0)
+        entman.update(0.01)
+        self.assertEquals(list(entman.lod_distances([entity])), [100])
+
+    def test_kill_dormant_entities(self):
+        """ Killed dormant entities should be freed, and never activated. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entity = entman.create_dormant_entity()
+        entman.create_queued_objects()
+        self.assertEquals(entman.entity_count(), 1)
+        entman.kill_dormant_entities()
+        entman.update(1)
+        assert entity.is_garbage
+        self.assertEquals(entman.entity_count(), 0)
+        self.assertEquals(entman.activate_dormant_entities(), [])
+
+    def test_load_keeps_serials(self):
+        """ Entities created after a load shouldn't reuse the serial numbers
+        of the loaded ones. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.create_entity()
+        entman.create_entity().kill()
+        entman.create_queued_objects()
+        saved = StringIO.StringIO()
+        entman.save(saved)
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.load(StringIO.StringIO(saved.getvalue()))
+        self.assertEquals(entman.create_entity().serial, 2)
+
+    def test_load_old_save(self):
+        """ Saves made before entities had serial numbers, or could be
+        dormant, should still load, and new entities should get serial
+        numbers that aren't in use. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.create_entity_with(MockComponent2)
+        entman.create_entity_with(MockComponent2)
+        entman.create_queued_objects()
+        saved = StringIO.StringIO()
+        entman.save(saved)
+
+        # Make it look like an old save.
+        state = pickle.loads(saved.getvalue())
+        del state["next_serial"]
+        del state["dormant_entities"]
+        for entity in state["entities"]:
+            del entity.__dict__["_Entity__is_dormant"]
+        del state["entities"][0].__dict__["_Entity__serial"]
+        saved = StringIO.StringIO(pickle.dumps(state))
+
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.load(saved)
+        loaded = entman.query(MockComponent2)
+        self.assertEquals(len(loaded), 2)
+        assert not any(e.is_dormant for e in loaded)
+        self.assertEquals(entman.create_entity().serial, 2)
+
 class ComponentSystemTest(unittest.TestCase):
 
     def create_system_and_component(self):
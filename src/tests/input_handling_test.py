@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ..input_handling import ActionRecorder, ActionReplay
+
+class ActionRecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "actions.rec")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """ A replay should give back the seed, and the actions recorded on
+        each tick, with none on ticks where nothing was recorded. """
+        recorder = ActionRecorder(self.filename, 1234)
+        recorder.tick = 2
+        recorder.record("thrust", "start", [])
+        recorder.record("aim", "move", [(10, 20)])
+        recorder.tick = 5
+        recorder.record("thrust", "stop", [])
+        recorder.close()
+        replay = ActionReplay(self.filename)
+        self.assertEquals(replay.seed, 1234)
+        self.assertEquals(replay.actions_at(0), [])
+        self.assertEquals(replay.actions_at(2), [
+            ("thrust", "start", []),
+            ("aim", "move", [(10, 20)])
+        ])
+        self.assertEquals(replay.actions_at(3), [])
+        self.assertEquals(replay.actions_at(5), [("thrust", "stop", [])])
+        self.assertEquals(replay.actions_at(6), [])
+
+if __name__ == '__main__':
+    unittest.main()
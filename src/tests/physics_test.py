@@ -0,0 +1,245 @@
+import multiprocessing
+import os
+import random
+import time
+import unittest
+from ..physics import *
+from ..components import Body, Joint, Attachment, Team
+from ..config import Config
+from testing import *
+
+def create_physics_testing_services(config=None):
+    game_services = create_entman_testing_services()
+    entman = game_services.get_entity_manager()
+    physics = Physics(config)
+    entman.register_component_system(physics)
+    return (game_services, entman, physics)
+
+def create_body_entity(entman, position=(0, 0)):
+    entity = entman.create_entity_with(Body)
+    entity.get_component(Body).position = Vec2d(position)
+    return entity
+
+class PhysicsTest(unittest.TestCase):
+
+    def test_body_mapping(self):
+        """ Bodies should be simulated from the update after they are added
+        until the update after they are killed. """
+        (game_services, entman, physics) = create_physics_testing_services()
+        entity = create_body_entity(entman)
+        entman.create_queued_objects()
+        assert physics.get_entity_at(Vec2d(0, 0)) is None
+        entman.update(0.01)
+        assert physics.get_entity_at(Vec2d(0, 0)) == entity
+        entity.kill()
+        entman.update(0.01)
+        assert physics.get_entity_at(Vec2d(0, 0)) is None
+
+    def test_body_pool(self):
+        """ Simulation bodies should be recycled for new bodies of the same
+        mass and size. """
+        (game_services, entman, physics) = create_physics_testing_services()
+        entity = create_body_entity(entman)
+        entman.create_queued_objects()
+        entman.update(0.01)
+        entity.kill()
+        entman.update(0.01)
+        self.assertEquals(physics.pool_stats()["free"], 1)
+        create_body_entity(entman, (100, 0))
+        entman.create_queued_objects()
+        entman.update(0.01)
+        self.assertEquals(physics.pool_stats()["hits"], 1)
+        self.assertEquals(physics.pool_stats()["free"], 0)
+        assert physics.get_entity_at(Vec2d(0, 0)) is None
+        assert physics.get_entity_at(Vec2d(100, 0)) is not None
+
+    def test_sleeping(self):
+        """ Idle bodies should fall asleep, and wake when their component is
+        written to or given an impulse. """
+        (game_services, entman, physics) = create_physics_testing_services()
+        entity = create_body_entity(entman)
+        entman.create_queued_objects()
+        for i in range(10):
+            entman.update(0.1)
+        self.assertEquals(physics.sleep_stats(), (0, 1))
+        body = entity.get_component(Body)
+        body.velocity = Vec2d(10, 0)
+        entman.update(0.1)
+        self.assertEquals(physics.sleep_stats(), (1, 0))
+        self.assertAlmostEquals(body.position.x, 1)
+        body.velocity = Vec2d(0, 0)
+        for i in range(10):
+            entman.update(0.1)
+        self.assertEquals(physics.sleep_stats(), (0, 1))
+        physics.apply_force_at_local_point(entity, Vec2d(100, 0), Vec2d(0, 0))
+        entman.update(0.1)
+        self.assertEquals(physics.sleep_stats(), (1, 0))
+        assert body.velocity.x > 0
+
+    def test_substep_forces(self):
+        """ A force should act for the whole update, however many substeps
+        the update is split into. """
+        velocities = []
+        for substeps in (1, 4):
+            (game_services, entman, physics) = \
+                create_physics_testing_services(Config({"substeps": substeps}))
+            entity = create_body_entity(entman)
+            entman.create_queued_objects()
+            physics.apply_force_at_local_point(entity, Vec2d(100, 0),
+                                               Vec2d(0, 0))
+            entman.update(1.0/60)
+            velocities.append(entity.get_component(Body).velocity.x)
+        self.assertAlmostEquals(velocities[0], velocities[1])
+        assert velocities[0] > 0
+
+    def test_dormant_body(self):
+        """ A dormant body shouldn't be simulated or queried until it is
+        activated. """
+        (game_services, entman, physics) = create_physics_testing_services()
+        entity = entman.create_dormant_entity(
+            Config({"components": {"src.physics.Body": {}}})
+        )
+        entman.create_queued_objects()
+        entman.update(0.01)
+        assert physics.get_entity_at(Vec2d(0, 0)) is None
+        self.assertEquals(entman.query(Body), [])
+        self.assertEquals(entman.activate_dormant_entities(), [entity])
+        entman.create_queued_objects()
+        entman.update(0.01)
+        assert physics.get_entity_at(Vec2d(0, 0)) == entity
+        self.assertEquals(entman.query(Body), [entity])
+
+    def test_joint_mapping(self):
+        """ A joint should be killed along with the bodies it connects. """
+        (game_services, entman, physics) = create_physics_testing_services()
+        e1 = create_body_entity(entman, (0, 0))
+        e2 = create_body_entity(entman, (100, 0))
+        joint_entity = entman.create_entity()
+        joint = Joint(joint_entity, game_services, Config())
+        joint.entity_a.entity = e1
+        joint.entity_b.entity = e2
+        joint_entity.add_component(joint)
+        entman.create_queued_objects()
+        entman.update(0.01)
+        assert not joint_entity.is_garbage
+        e2.kill()
+        entman.update(0.01)
+        assert joint_entity.is_garbage
+        assert physics.get_entity_at(Vec2d(0, 0)) == e1
+
+    def test_attachment(self):
+        """ An attached body should follow the point on its parent that it is
+        attached to, without being simulated if it isn't collideable. """
+        (game_services, entman, physics) = create_physics_testing_services()
+        parent = create_body_entity(entman, (100, 0))
+        parent_body = parent.get_component(Body)
+        parent_body.orientation = 90
+        parent_body.velocity = Vec2d(10, 0)
+        child = create_body_entity(entman)
+        child.get_component(Body).is_collideable = False
+        attachment = Attachment(child, game_services, Config())
+        attachment.parent.entity = parent
+        attachment.position = Vec2d(50, 0)
+        child.add_component(attachment)
+        entman.create_queued_objects()
+        entman.update(1)
+        child_body = child.get_component(Body)
+        self.assertAlmostEqual(child_body.position.x, 110)
+        self.assertAlmostEqual(child_body.position.y, 50)
+        self.assertAlmostEqual(child_body.velocity.x, 10)
+        assert physics.get_entity_at(Vec2d(110, 50)) is None
+
+    def test_collision_dispatch(self):
+        """ Handlers should be called for matching pairs of components, with
+        the components in the order the handler asked for. """
+        (game_services, entman, physics) = create_physics_testing_services()
+        handler = MockCollisionHandler()
+        physics.add_collision_handler(handler)
+        e1 = entman.create_entity_with(MockComponentB, Body)
+        e2 = entman.create_entity_with(MockComponentA, Body)
+        e2.get_component(Body).position = Vec2d(1, 0)
+        e3 = entman.create_entity_with(Body)
+        e3.get_component(Body).position = Vec2d(1000, 0)
+        e4 = entman.create_entity_with(MockComponentB, Body)
+        e4.get_component(Body).position = Vec2d(1001, 0)
+        entman.create_queued_objects()
+        entman.update(0.01)
+        self.assertEquals(handler.collisions, [
+            (e2.get_component(MockComponentA), e1.get_component(MockComponentB))
+        ])
+
+    def test_spatial_hash(self):
+        """ Collisions and queries should work the same with a spatial hash
+        broadphase, and with substeps. """
+        (game_services, entman, physics) = create_physics_testing_services(
+            Config({"broadphase": "auto", "substeps": 4})
+        )
+        handler = MockCollisionHandler()
+        physics.add_collision_handler(handler)
+        e1 = entman.create_entity_with(MockComponentA, Body)
+        e2 = entman.create_entity_with(MockComponentB, Body)
+        e2.get_component(Body).position = Vec2d(1, 0)
+        e3 = create_body_entity(entman, (500, 0))
+        entman.create_queued_objects()
+        entman.update(0.01)
+        self.assertEquals(handler.collisions, [
+            (e1.get_component(MockComponentA), e2.get_component(MockComponentB))
+        ])
+        assert physics.get_entity_at(Vec2d(500, 0)) == e3
+
+    def test_team_filter(self):
+        """ Bodies on the same team shouldn't collide, and non-collideable
+        bodies shouldn't collide with anything. """
+        (game_services, entman, physics) = create_physics_testing_services()
+        handler = MockCollisionHandler()
+        physics.add_collision_handler(handler)
+        def create(component_type, team, position, is_collideable=True):
+            entity = entman.create_entity_with(component_type, Team, Body)
+            entity.get_component(Team).team = team
+            body = entity.get_component(Body)
+            body.position = Vec2d(position)
+            body.is_collideable = is_collideable
+            return entity
+        create(MockComponentA, "red", (0, 0))
+        create(MockComponentB, "red", (1, 0))
+        create(MockComponentA, "red", (1000, 0))
+        create(MockComponentB, "blue", (1000, 1), False)
+        e1 = create(MockComponentA, "red", (2000, 0))
+        e2 = create(MockComponentB, "blue", (2000, 1))
+        entman.create_queued_objects()
+        entman.update(0.01)
+        self.assertEquals(handler.collisions, [
+            (e1.get_component(MockComponentA), e2.get_component(MockComponentB))
+        ])
+
+@unittest.skipUnless(os.environ.get("BENCHMARK"), "set BENCHMARK=1 to run")
+class PhysicsBenchmark(unittest.TestCase):
+
+    def test_threaded_step_time(self):
+        """ Print the time per update against the number of solver threads,
+        for crowds of touching bodies. """
+        thread_counts = sorted(set([1, 2, multiprocessing.cpu_count()]))
+        print("")
+        print("bodies  threads  ms/update")
+        for count in (500, 2000, 5000):
+            for threads in thread_counts:
+                (game_services, entman, physics) = \
+                    create_physics_testing_services(
+                        Config({"threaded": 1, "threads": threads})
+                    )
+                random.seed(0)
+                extent = (count ** 0.5) * 8
+                for i in range(count):
+                    create_body_entity(entman, (random.uniform(0, extent),
+                                                random.uniform(0, extent)))
+                entman.create_queued_objects()
+                physics.update(1.0/60)
+                frames = 30
+                start = time.time()
+                for i in range(frames):
+                    physics.update(1.0/60)
+                elapsed = (time.time() - start) * 1000 / frames
+                print("%6d  %7d  %9.2f" % (count, threads, elapsed))
+
+if __name__ == '__main__':
+    unittest.main()
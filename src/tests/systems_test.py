@@ -0,0 +1,556 @@
+import unittest
+from ..systems import *
+from ..physics import CollisionHandler, CollisionResult
+from ..resource import Animation
+from ..thrust import ThrustSolutionCache
+from testing import *
+
+class DamageHandler(CollisionHandler):
+    """ Queues damage, as the game's handler does. """
+    def __init__(self, damage_system):
+        CollisionHandler.__init__(self, DamageOnContact, Hitpoints)
+        self.damage_system = damage_system
+    def handle_matching_collision(self, dmg, hp):
+        self.damage_system.queue_damage(dmg, hp)
+        return CollisionResult(True, True)
+
+class RecordingParticleSystem(ParticleSystem):
+    """ Records the particles emitted rather than simulating them. """
+    def __init__(self):
+        ParticleSystem.__init__(self)
+        self.emitted = []
+    def emit(self, config_name, position, velocity):
+        self.emitted.append((config_name, Vec2d(position)))
+
+class ProjectileSystemTest(unittest.TestCase):
+
+    def test_fast_projectile_hits(self):
+        """ A projectile should hit things it passes through during a step,
+        however fast it is going. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        physics = Physics()
+        entman.register_component_system(physics)
+        entman.register_component_system(ProjectileSystem())
+        handler = MockCollisionHandler()
+        physics.add_collision_handler(handler)
+        target = entman.create_entity_with(MockComponentB, Body)
+        target.get_component(Body).position = Vec2d(100, 0)
+        projectile = entman.create_entity_with(MockComponentA, Projectile, Body)
+        projectile.get_component(Body).velocity = Vec2d(10000, 0)
+        entman.create_queued_objects()
+        entman.update(0.1)
+        self.assertEquals(handler.collisions, [
+            (projectile.get_component(MockComponentA),
+             target.get_component(MockComponentB))
+        ])
+        self.assertEquals(projectile.get_component(Body).position, Vec2d(95, 0))
+
+    def test_explosion_at_hit(self):
+        """ A projectile that's destroyed by a hit should explode where it
+        hit, not where it would have got to. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        physics = Physics()
+        entman.register_component_system(physics)
+        entman.register_component_system(ProjectileSystem())
+        damage_system = DamageSystem()
+        entman.register_component_system(damage_system)
+        particles = RecordingParticleSystem()
+        entman.register_component_system(particles)
+        entman.register_component_system(CameraSystem())
+        physics.add_collision_handler(DamageHandler(damage_system))
+        target = entman.create_entity(Config({"components": {
+            "src.physics.Body": {},
+            "src.components.Hitpoints": {"hp": 10}
+        }}))
+        target.get_component(Body).position = Vec2d(100, 0)
+        projectile = entman.create_entity(Config({"components": {
+            "src.components.Projectile": {},
+            "src.components.DamageOnContact": {"damage": 1},
+            "src.components.ExplodesOnDeath": {"explosion_config":
+                "explosions/green_explosion.txt"},
+            "src.physics.Body": {}
+        }}))
+        projectile.get_component(Body).velocity = Vec2d(500, 0)
+        entman.create_queued_objects()
+        entman.update(0.1)
+        entman.update(0.1)
+        assert projectile.is_garbage
+        self.assertEquals(particles.emitted, [
+            ("explosions/green_explosion.txt", Vec2d(95, 0))
+        ])
+
+class DamageSystemTest(unittest.TestCase):
+
+    def test_damage_is_applied_together(self):
+        """ Queued damage should be added up per target and applied once,
+        and bullets that are destroyed on hit should only do damage once. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        system = DamageSystem()
+        entman.register_component_system(system)
+        def create_bullet():
+            return entman.create_entity(Config({"components": {
+                "src.components.DamageOnContact": {"damage": 3}
+            }}))
+        target = entman.create_entity(Config({"components": {
+            "src.components.Hitpoints": {"hp": 10}
+        }}))
+        bullets = [create_bullet(), create_bullet()]
+        entman.create_queued_objects()
+        hitpoints = target.get_component(Hitpoints)
+        for bullet in bullets + bullets:
+            system.queue_damage(bullet.get_component(DamageOnContact),
+                                hitpoints)
+        assert not bullets[0].is_garbage
+        entman.update(0.1)
+        self.assertEquals(hitpoints.hp, 4)
+        assert bullets[0].is_garbage and bullets[1].is_garbage
+        assert not target.is_garbage
+
+    def test_blasts(self):
+        """ Blasts should damage hostile things in range, less so further
+        out, with the damage of all the blasts in an update added up. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.register_component_system(Physics())
+        system = DamageSystem()
+        entman.register_component_system(system)
+        def create(team, position):
+            entity = entman.create_entity(Config({"components": {
+                "src.components.Team": {"team": team},
+                "src.physics.Body": {"size": 10},
+                "src.components.Hitpoints": {"hp": 100}
+            }}))
+            entity.get_component(Body).position = Vec2d(position)
+            return entity.get_component(Hitpoints)
+        centre = create("blue", (0, 0))
+        between = create("blue", (100, 0))
+        friendly = create("red", (0, 20))
+        distant = create("blue", (1000, 0))
+        entman.create_queued_objects()
+        entman.update(0.01)
+        blast = Config({"radius": 100, "damage": 10})
+        system.queue_blast(Vec2d(0, 0), blast, "red")
+        system.queue_blast(Vec2d(200, 0), blast, "red")
+        entman.update(0.01)
+        self.assertAlmostEquals(centre.hp, 90)
+        self.assertAlmostEquals(between.hp, 98)
+        self.assertEquals(friendly.hp, 100)
+        self.assertEquals(distant.hp, 100)
+
+    def test_distant_blasts(self):
+        """ Blasts far apart should each only search the area around
+        themselves, and overlapping blasts should share a search. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        physics = Physics()
+        entman.register_component_system(physics)
+        system = DamageSystem()
+        entman.register_component_system(system)
+        def create(position):
+            entity = entman.create_entity(Config({"components": {
+                "src.physics.Body": {"size": 10},
+                "src.components.Hitpoints": {"hp": 100}
+            }}))
+            entity.get_component(Body).position = Vec2d(position)
+            return entity.get_component(Hitpoints)
+        left = create((-10000, 0))
+        right = create((10000, 0))
+        entman.create_queued_objects()
+        entman.update(0.01)
+        boxes = []
+        get_entities_in_box = physics.get_entities_in_box
+        def recording_get_entities_in_box(lower, upper):
+            boxes.append((tuple(lower), tuple(upper)))
+            return get_entities_in_box(lower, upper)
+        physics.get_entities_in_box = recording_get_entities_in_box
+        blast = Config({"radius": 100, "damage": 10})
+        system.queue_blast(Vec2d(-10000, 0), blast, None)
+        system.queue_blast(Vec2d(10000, 0), blast, None)
+        system.queue_blast(Vec2d(-9900, 0), blast, None)
+        entman.update(0.01)
+        self.assertEquals(boxes, [((-10100, -100), (-9800, 100)),
+                                  ((9900, -100), (10100, 100))])
+        self.assertAlmostEquals(left.hp, 89)
+        self.assertAlmostEquals(right.hp, 90)
+
+class BudgetSystemTest(unittest.TestCase):
+
+    def test_oldest_is_recycled(self):
+        """ When a category or a team is at its cap, the oldest entity in it
+        should be recycled to make room. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        budgets = BudgetSystem(Config({"bullets": {"cap": 3, "team_cap": 2}}))
+        entman.register_component_system(budgets)
+        def spawn(team):
+            budgets.make_room("bullets", team)
+            entity = entman.create_entity()
+            budgets.add("bullets", team, entity)
+            return entity
+        red = [spawn("red"), spawn("red")]
+        blue = [spawn("blue")]
+        assert not any(e.is_garbage for e in red + blue)
+        red.append(spawn("red"))
+        self.assertEquals([e.is_garbage for e in red], [True, False, False])
+        blue.append(spawn("blue"))
+        self.assertEquals([e.is_garbage for e in red], [True, True, False])
+        self.assertEquals(budgets.stats()["bullets"],
+                          {"live": 3, "recycled": 2, "merged": 0, "dropped": 0})
+
+    def test_dead_are_forgotten(self):
+        """ Entities that have died shouldn't count against the budget, or be
+        recycled. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        budgets = BudgetSystem(Config({"bullets": {"cap": 2}}))
+        entman.register_component_system(budgets)
+        def spawn():
+            budgets.make_room("bullets", "red")
+            entity = entman.create_entity_with(Body)
+            budgets.add("bullets", "red", entity)
+            return entity
+        bullets = [spawn(), spawn()]
+        entman.create_queued_objects()
+        bullets[0].kill()
+        self.assertEquals(budgets.stats()["bullets"]["live"], 1)
+        entman.update(0.01)
+        self.assertEquals(budgets.stats()["bullets"]["live"], 1)
+        bullets.append(spawn())
+        assert not bullets[1].is_garbage
+        self.assertEquals(budgets.stats()["bullets"],
+                          {"live": 2, "recycled": 0, "merged": 0, "dropped": 0})
+
+class ParticleSystemTest(unittest.TestCase):
+
+    def test_emitter(self):
+        """ Particles should move, run through their animation frames, and be
+        removed when their animation finishes. """
+        emitter = ParticleSystem.Emitter(Animation(["a", "b", "c"], 1.0),
+                                         capacity=1)
+        emitter.emit(Vec2d(0, 0), Vec2d(10, 0))
+        emitter.update(0.5)
+        emitter.emit(Vec2d(100, 0), Vec2d(0, 0))
+        self.assertEquals(emitter.count, 2)
+        self.assertEquals(emitter.frame_indices().tolist(), [1, 0])
+        emitter.update(0.6)
+        self.assertEquals(emitter.count, 1)
+        self.assertEquals(emitter.positions[0].tolist(), [100, 0])
+        self.assertEquals(emitter.frame_indices().tolist(), [1])
+        assert emitter.merge(Vec2d(10, 0), 20) is False
+        emitter.emit(Vec2d(0, 0), Vec2d(0, 0))
+        assert emitter.merge(Vec2d(10, 0), 20) is True
+        emitter.recycle(Vec2d(50, 50), Vec2d(0, 0))
+        self.assertEquals(emitter.positions[0].tolist(), [50, 50])
+
+class LeadTargetingTest(unittest.TestCase):
+
+    def test_solve_intercepts(self):
+        """ Bullets fired in the solved directions should meet their targets,
+        or be fired straight at targets they can't catch. """
+        shooters = numpy.array([[0, 0], [0, 0], [50, 50], [0, 0]], dtype=float)
+        shooter_velocities = numpy.array([[0, 0], [0, 0], [10, 0], [0, 0]],
+                                         dtype=float)
+        targets = numpy.array([[100, 0], [100, 0], [150, 50], [100, 0]],
+                              dtype=float)
+        target_velocities = numpy.array([[0, 100], [300, 0], [10, 200], [-200, 0]],
+                                        dtype=float)
+        speeds = numpy.array([200, 200, 300, 200], dtype=float)
+        directions = solve_intercepts(shooters, shooter_velocities, targets,
+                                      target_velocities, speeds)
+        self.assertAlmostEquals(directions[1][0], 1)
+        for i in (0, 2, 3):
+            r = targets[i] - shooters[i]
+            v = target_velocities[i] - shooter_velocities[i]
+            closing = speeds[i] * directions[i] - v
+            t = r.dot(closing) / closing.dot(closing)
+            miss = r - closing * t
+            assert t > 0
+            self.assertAlmostEquals(numpy.sqrt(miss.dot(miss)), 0)
+
+class EffectSystemTest(unittest.TestCase):
+
+    def test_effect_moves(self):
+        """ An effect should move with its velocity, and pick up teleports,
+        without being added to the physics simulation. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        physics = Physics()
+        entman.register_component_system(physics)
+        entman.register_component_system(EffectSystem())
+        effect = entman.create_entity_with(Effect, Body)
+        effect.get_component(Body).velocity = Vec2d(10, 0)
+        entman.create_queued_objects()
+        entman.update(1)
+        self.assertEquals(effect.get_component(Body).position, Vec2d(10, 0))
+        assert physics.get_entity_at(Vec2d(10, 0)) is None
+        teleport(effect, Vec2d(100, 100))
+        entman.update(1)
+        self.assertEquals(effect.get_component(Body).position, Vec2d(110, 100))
+
+class TrackingSystemTest(unittest.TestCase):
+
+    def test_nearest_hostile(self):
+        """ Trackers should track the nearest hostile body in range, and
+        wait before looking again if there isn't one. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.register_component_system(Physics())
+        entman.register_component_system(TrackingSystem())
+        def create(team, position, *types):
+            entity = entman.create_entity_with(Team, Body, *types)
+            entity.get_component(Team).team = team
+            entity.get_component(Body).position = Vec2d(position)
+            return entity
+        tracker = create("red", (0, 0), Tracking)
+        limited = create("red", (0, 1000), Tracking)
+        limited.get_component(Tracking).range = 100
+        create("red", (10, 0))
+        create(None, (20, 0))
+        near = create("blue", (0, 300))
+        create("blue", (0, -400))
+        entman.create_queued_objects()
+        entman.update(0.01)
+        self.assertEquals(tracker.get_component(Tracking).tracked.entity, near)
+        self.assertEquals(limited.get_component(Tracking).tracked.entity, None)
+        nearer = create("blue", (0, 950))
+        entman.create_queued_objects()
+        entman.update(0.01)
+        self.assertEquals(limited.get_component(Tracking).tracked.entity, None)
+        entman.update(0.25)
+        self.assertEquals(limited.get_component(Tracking).tracked.entity, nearer)
+
+    def test_bullets_are_not_targets(self):
+        """ Trackers should go for the nearest ship, even if a bullet is
+        closer. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.register_component_system(Physics())
+        entman.register_component_system(TrackingSystem())
+        def create(team, position, *types):
+            entity = entman.create_entity_with(Team, Body, *types)
+            entity.get_component(Team).team = team
+            entity.get_component(Body).position = Vec2d(position)
+            return entity
+        tracker = create("red", (0, 0), Tracking)
+        create("blue", (0, 50), Projectile)
+        create("blue", (0, 60), Effect)
+        ship = create("blue", (0, 300))
+        entman.create_queued_objects()
+        entman.update(0.01)
+        self.assertEquals(tracker.get_component(Tracking).tracked.entity, ship)
+
+class PowerSystemTest(unittest.TestCase):
+
+    def test_distant_updates(self):
+        """ Distant entities should be updated less often, with the time since
+        their last update, so that they keep up with near ones. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        system = PowerSystem()
+        entman.register_component_system(system)
+        def create(position):
+            entity = entman.create_entity(Config({"components": {
+                "src.physics.Body": {},
+                "src.components.Power": {"capacity": 100, "recharge_rate": 10}
+            }}))
+            entity.get_component(Body).position = Vec2d(position)
+            entity.get_component(Power).power = 0
+            return entity
+        near = create((0, 0))
+        far = create((5000, 0))
+        entman.create_queued_objects()
+        entman.set_lod_origins([(0, 0)], body_position)
+        far_updates = 0
+        for i in range(60):
+            before = far.get_component(Power).power
+            system.update(1.0/60)
+            if far.get_component(Power).power != before:
+                far_updates += 1
+        self.assertAlmostEquals(near.get_component(Power).power, 10)
+        assert 7.5 <= far.get_component(Power).power <= 10.0001
+        assert far_updates <= 5
+
+class SquadronSystemTest(unittest.TestCase):
+
+    def test_collapse_and_expand(self):
+        """ Fighters far from anything hostile should be collapsed into a
+        squadron, and put back, sharing its damage, when something comes
+        near. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.register_component_system(Physics())
+        entman.register_component_system(SquadronSystem(Config({
+            "collapse_distance": 1000,
+            "expand_distance": 500,
+            "check_period": 0.1
+        })))
+        carrier = entman.create_entity(Config({"components": {
+            "src.components.Team": {"team": "red"},
+            "src.physics.Body": {},
+            "src.components.LaunchesFighters": {
+                "spawn_period": 10,
+                "fighter_config": {"components": {
+                    "src.components.Team": {},
+                    "src.physics.Body": {},
+                    "src.components.Hitpoints": {"hp": 10}
+                }},
+                "squadron_config": {"components": {
+                    "src.components.Team": {},
+                    "src.physics.Body": {},
+                    "src.components.Hitpoints": {"hp": 1},
+                    "src.components.Squadron": {}
+                }}
+            }
+        }}))
+        carrier.get_component(Body).position = Vec2d(0, -100)
+        launcher = carrier.get_component(LaunchesFighters)
+        for position in ((0, 0), (50, 0)):
+            fighter = entman.create_entity(launcher.config["fighter_config"])
+            setup_team(carrier, fighter)
+            fighter.get_component(Body).position = Vec2d(position)
+            launcher.launched.add_ref_to(fighter)
+        enemy = entman.create_entity_with(Team, Body)
+        enemy.get_component(Team).team = "blue"
+        enemy.get_component(Body).position = Vec2d(5000, 0)
+        entman.create_queued_objects()
+        entman.update(0.1)
+        entman.create_queued_objects()
+        self.assertEquals(len(launcher.launched), 1)
+        squadron = launcher.launched[0]
+        hitpoints = squadron.get_component(Hitpoints)
+        self.assertEquals(hitpoints.hp, 20)
+        self.assertEquals(get_team(squadron), "red")
+        hitpoints.hp = 10
+        enemy.get_component(Body).position = Vec2d(300, 0)
+        entman.update(0.1)
+        entman.create_queued_objects()
+        assert squadron.is_garbage
+        fighters = list(launcher.launched)
+        self.assertEquals(len(fighters), 2)
+        for fighter in fighters:
+            self.assertEquals(fighter.get_component(Hitpoints).hp, 5)
+            self.assertEquals(get_team(fighter), "red")
+        positions = sorted(f.get_component(Body).position.x for f in fighters)
+        self.assertAlmostEquals(positions[0], 0)
+        self.assertAlmostEquals(positions[1], 50)
+
+class FollowsTrackedSystemTest(unittest.TestCase):
+
+    def test_flocking(self):
+        """ Followers should head for what they're tracking, and flocking
+        followers should also keep apart from each other. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.register_component_system(Physics())
+        entman.register_component_system(FollowsTrackedSystem())
+        target = entman.create_entity_with(Body)
+        target.get_component(Body).position = Vec2d(0, 1000)
+        def create(x, flocking):
+            follows = {"acceleration": 100, "desired_distance_to_player": 10}
+            if flocking:
+                follows.update({"separation": 1000, "flock_distance": 50})
+            entity = entman.create_entity(Config({"components": {
+                "src.components.Body": {},
+                "src.components.Tracking": {},
+                "src.components.FollowsTracked": follows
+            }}))
+            entity.get_component(Body).position = Vec2d(x, 0)
+            entity.get_component(Tracking).tracked.entity = target
+            return entity
+        followers = [create(-10, False), create(10, False),
+                     create(-10, True), create(10, True)]
+        entman.create_queued_objects()
+        entman.get_system(FollowsTrackedSystem).update(0.1)
+        forces = [f.get_component(Body).impulses[0][0] for f in followers]
+        self.assertAlmostEquals(forces[0].length, 100)
+        assert forces[0].y > 99
+        self.assertAlmostEquals(forces[2].y, forces[0].y)
+        self.assertAlmostEquals(forces[3].y, forces[1].y)
+        assert forces[2].x < forces[0].x - 100
+        assert forces[3].x > forces[1].x + 100
+
+def net_thrust(thrusters, thrusts):
+    """ Get the net force and moment of some thrusts. """
+    force = Vec2d(0, 0)
+    moment = 0
+    for (n, thrust) in enumerate(thrusts):
+        f = Vec2d(thrusters.directions[n].tolist()) * float(thrust)
+        force += f
+        moment += Vec2d(thrusters.positions[n].tolist()).cross(f)
+    return (force, moment)
+
+class ThrustersSystemTest(unittest.TestCase):
+
+    def test_thrust_solution_is_optimal(self):
+        """ The computed thrusts should do at least as well as any other
+        combination of thrusters being on or off, for the player's ship. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        system = ThrustersSystem()
+        entman.register_component_system(system)
+        entity = entman.create_entity("player.txt")
+        thrusters = entity.get_component(Thrusters)
+        def score(thrusts, direction, turn):
+            (force, moment) = net_thrust(thrusters, thrusts)
+            return direction.normalized().dot(force) + numpy.sign(turn) * moment
+        for x in (-1, 0, 1):
+            for y in (-1, 0, 1):
+                for turn in (-1, 0, 1):
+                    direction = Vec2d(x, y)
+                    thrusts = system.compute_correct_thrusters(
+                        thrusters, direction, turn)
+                    best = score(thrusts, direction, turn)
+                    for i in range(1 << len(thrusters.layout)):
+                        other = [m if i & (1 << n) else 0 for (n, m)
+                                 in enumerate(thrusters.max_thrusts)]
+                        assert score(other, direction, turn) <= best + 1e-6
+
+    def test_single_impulse(self):
+        """ The thrusters should be applied as a single impulse with the same
+        net force and moment, or as a couple if the forces cancel out. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.register_component_system(Physics())
+        entman.register_component_system(ThrustersSystem())
+        entity = entman.create_entity("player.txt")
+        entman.create_queued_objects()
+        body = entity.get_component(Body)
+        thrusters = entity.get_component(Thrusters)
+        for (direction, turn, count) in (((0, 1), 1, 1), ((0, 0), 1, 2)):
+            thrusters.direction = Vec2d(direction)
+            thrusters.turn = turn
+            body.impulses = []
+            entman.get_system(ThrustersSystem).update(0.1)
+            self.assertEquals(len(body.impulses), count)
+            (force, moment) = net_thrust(thrusters, thrusters.thrusts)
+            self.assertAlmostEquals(
+                (sum((f for (f, p) in body.impulses), Vec2d(0, 0)) - force).length,
+                0)
+            self.assertAlmostEquals(
+                sum(p.cross(f) for (f, p) in body.impulses), moment)
+
+    def test_solutions_are_shared(self):
+        """ Ships with the same thrusters should share cached solutions, and
+        the least recently used solutions should be evicted. """
+        game_services = create_entman_testing_services()
+        entman = game_services.get_entity_manager()
+        entman.register_component_system(Physics())
+        entman.register_component_system(ThrustersSystem())
+        ships = [entman.create_entity("player.txt") for i in range(2)]
+        entman.create_queued_objects()
+        for ship in ships:
+            ship.get_component(Thrusters).direction = Vec2d(0, 1)
+        entman.update(0.1)
+        solutions = game_services.get_resource_loader().get_thrust_solutions()
+        self.assertEquals((solutions.misses, solutions.hits), (1, 1))
+        cache = ThrustSolutionCache(max_entries=2)
+        layout = ships[0].get_component(Thrusters).layout
+        for direction in ((0, 1), (1, 0), (0, 1), (-1, 0), (0, 1), (1, 0)):
+            cache.get(layout, Vec2d(direction), 0)
+        self.assertEquals((cache.misses, cache.hits, len(cache)), (4, 2, 2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,8 @@
 
 import pygame
 
-from ..ecs import GameServices, Entity, EntityManager
+from ..ecs import GameServices, Entity, EntityManager, Component
+from ..physics import CollisionHandler, CollisionResult
 from ..resource import ResourceLoader
 from ..config import Config
 from ..components import Camera
@@ -36,6 +37,24 @@ class MockGameServices(GameServices):
         if self.on_end_game is not None:
             self.on_end_game
 
+class MockComponentA(Component):
+    """ A component for testing collision handling. """
+    pass
+
+class MockComponentB(Component):
+    """ Another component for testing collision handling. """
+    pass
+
+class MockCollisionHandler(CollisionHandler):
+    """ Records the collisions between MockComponentAs and
+    MockComponentBs. """
+    def __init__(self):
+        CollisionHandler.__init__(self, MockComponentA, MockComponentB)
+        self.collisions = []
+    def handle_matching_collision(self, c1, c2):
+        self.collisions.append((c1, c2))
+        return CollisionResult(True, False)
+
 # We only want to initialise pygame once, and then have subsequent tests
 # re-use it. This is because if you keep turning it off and on again, it
 # segfaults.
@@ -0,0 +1,135 @@
+"""
+Thrust allocation: working out which of a ship's thrusters to fire to move in
+a given direction and turn a given way, and caching the answers.
+
+A ship's thrusters are described by a 'layout', a tuple with a
+(x, y, direction x, direction y, max thrust) tuple for each thruster. Ships
+built from the same config share a layout, and so share cached solutions.
+"""
+
+from .utils import Vec2d
+
+import collections
+import numpy
+import pickle
+
+
+def thruster_layout(thruster_configs):
+    """ Get the layout of a list of thruster configs, as given in the
+    'thrusters' list of a Thrusters component's config. """
+    layout = []
+    for cfg in thruster_configs:
+        (x, y) = cfg.get_or_default("position", (0, 0))
+        (dx, dy) = cfg.get_or_default("orientation", (0, 1))
+        max_thrust = cfg.get_or_default("max_thrust", 0)
+        layout.append((float(x), float(y), float(dx), float(dy),
+                       float(max_thrust)))
+    return tuple(layout)
+
+
+def solve_thrusts(layout, direction, turn):
+    """ Work out the thrust for each thruster in a layout, to best move in
+    the given direction while turning in the sense of 'turn'.
+
+    We have a set of N thrusters, where thruster n has thrust Tn, a unit
+    direction Dn, a position Pn relative to the centre of mass, and a maximum
+    thrust TMAXn, so that 0 <= Tn <= TMAXn. Its force is Tn*Dn and its moment
+    is Pn x (Tn*Dn).
+
+    We want to maximise the resultant force in the desired direction, d, plus
+    the resultant moment in the desired sense of turn, s:
+
+        sum(Tn * (d . Dn + s * (Pn x Dn)))
+
+    That's linear in the thrusts and each thrust is bounded independently, so
+    each thruster can be chosen on its own: it fires at full thrust if its
+    term is positive, and is off otherwise. The terms are computed for all
+    thrusters at once.
+
+    Returns an array of the thrusts.
+    """
+    if len(layout) == 0:
+        return numpy.zeros(0)
+    thrusters = numpy.array(layout)
+    positions = thrusters[:, 0:2]
+    directions = thrusters[:, 2:4]
+    max_thrusts = thrusters[:, 4]
+    goal = Vec2d(direction).normalized()
+    moments = positions[:, 0] * directions[:, 1] - \
+        positions[:, 1] * directions[:, 0]
+    gains = directions.dot((goal.x, goal.y)) + numpy.sign(turn) * moments
+    return numpy.where(gains > 0, max_thrusts, 0.0)
+
+
+class ThrustSolutionCache(object):
+    """ A bounded cache of thrust solutions, shared by all ships. Solutions
+    are keyed by the layout and by the direction and turn, quantised so that
+    analogue input can't grow the cache without limit; the least recently
+    used solutions are evicted when it's full. The cache can be saved to and
+    loaded from a file, so it needn't be rebuilt each run. """
+
+    # Directions are quantised to a grid with this many steps per unit.
+    DIRECTION_STEPS = 64
+
+    def __init__(self, max_entries=4096):
+        """ Constructor. """
+        self.__solutions = collections.OrderedDict()
+        self.__max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """ Get the number of cached solutions. """
+        return len(self.__solutions)
+
+    @staticmethod
+    def quantise(direction, turn):
+        """ Get the quantised direction and turn. A direction on the grid
+        points the same way after quantisation, so keyboard input gives
+        exactly the solutions it would without the cache. """
+        goal = Vec2d(direction).normalized()
+        steps = ThrustSolutionCache.DIRECTION_STEPS
+        return (int(round(goal.x * steps)),
+                int(round(goal.y * steps)),
+                int(numpy.sign(turn)))
+
+    def get(self, layout, direction, turn):
+        """ Get the thrusts for a layout, solving if we need to. """
+        (x, y, turn) = self.quantise(direction, turn)
+        key = (layout, x, y, turn)
+        solution = self.__solutions.pop(key, None)
+        if solution is None:
+            self.misses += 1
+            solution = solve_thrusts(layout, Vec2d(x, y), turn)
+            if len(self.__solutions) >= self.__max_entries:
+                self.__solutions.popitem(last=False)
+        else:
+            self.hits += 1
+        self.__solutions[key] = solution
+        return solution
+
+    def precompute(self, layout):
+        """ Solve for all of the directions and turns that keyboard input can
+        ask for. """
+        for x in (-1, 0, 1):
+            for y in (-1, 0, 1):
+                for turn in (-1, 0, 1):
+                    self.get(layout, Vec2d(x, y), turn)
+
+    def save(self, filename):
+        """ Save the cached solutions to a file. """
+        with open(filename, "wb") as f:
+            pickle.dump(list(self.__solutions.items()), f)
+
+    def load(self, filename):
+        """ Load solutions saved by save(), if the file exists. """
+        try:
+            with open(filename, "rb") as f:
+                items = pickle.load(f)
+        except IOError:
+            return
+        for (key, solution) in items[-self.__max_entries:]:
+            self.__solutions.pop(key, None)
+            if len(self.__solutions) >= self.__max_entries:
+                self.__solutions.popitem(last=False)
+            self.__solutions[key] = solution